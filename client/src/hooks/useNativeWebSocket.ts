@@ -13,6 +13,8 @@ const useNativeWebSocket = (chatId: number): UseWebSocketReturn => {
   const socketRef = useRef<WebSocket | null>(null);
   const reconnectTimeoutRef = useRef<NodeJS.Timeout | null>(null);
   const messageCallbackRef = useRef<((message: Message) => void) | null>(null);
+  // Delay the server asked for before it restarts (jittered so clients spread out)
+  const restartDelayRef = useRef<number | null>(null);
 
   const onMessage = useCallback((callback: (message: Message) => void) => {
     messageCallbackRef.current = callback;
@@ -60,6 +62,15 @@ const useNativeWebSocket = (chatId: number): UseWebSocketReturn => {
         console.log("WebSocket message received:", event.data);
         try {
           const data = JSON.parse(event.data);
+          if (data.type === "ping") {
+            // Answer server heartbeats so the connection is not reaped as dead
+            socket.send(JSON.stringify({ type: "pong" }));
+            return;
+          }
+          if (data.type === "reconnect") {
+            restartDelayRef.current = typeof data.after_ms === "number" ? data.after_ms : null;
+            return;
+          }
           if (data.type === "new_message" && data.message && messageCallbackRef.current) {
             // Convert the message to the expected format
             const message: Message = {
@@ -87,6 +98,16 @@ const useNativeWebSocket = (chatId: number): UseWebSocketReturn => {
           setError("You are not a participant in this chat");
         } else if (event.code === 4004) {
           setError("Chat not found");
+        } else if (event.code === 1012) {
+          // Server is restarting: reconnect after the delay it handed out, or a random one
+          setError(null);
+          const delay = restartDelayRef.current ?? Math.random() * 15000;
+          restartDelayRef.current = null;
+          if (chatId && chatId !== 0) {
+            reconnectTimeoutRef.current = setTimeout(() => {
+              connect();
+            }, delay);
+          }
         } else if (event.code === 1000) {
           // Normal closure
           setError(null);
@@ -0,0 +1,30 @@
+"""Read state high-water marks
+
+Revision ID: 5b1e7c9a4d20
+Revises: 2c832b175ef8
+Create Date: 2026-10-19 10:12:41.208113
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1e7c9a4d20'
+down_revision: Union[str, Sequence[str], None] = '2c832b175ef8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chat_participant', sa.Column('last_read_message_id', sa.Integer(), nullable=True))
+    op.create_index('ix_message_chat_id_id', 'message', ['chat_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_message_chat_id_id', table_name='message')
+    op.drop_column('chat_participant', 'last_read_message_id')
@@ -0,0 +1,51 @@
+"""Logical delete and purge jobs
+
+Revision ID: 8f3a2d61c0b4
+Revises: 5b1e7c9a4d20
+Create Date: 2026-10-19 11:03:18.554920
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f3a2d61c0b4'
+down_revision: Union[str, Sequence[str], None] = '5b1e7c9a4d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chat', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.add_column('user', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.create_table('purge_job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('target_id', sa.Integer(), nullable=False),
+    sa.Column('status', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('messages_deleted', sa.Integer(), nullable=False),
+    sa.Column('participants_deleted', sa.Integer(), nullable=False),
+    sa.Column('error', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_purge_job_target_id'), 'purge_job', ['target_id'], unique=False)
+    op.create_index(op.f('ix_purge_job_status'), 'purge_job', ['status'], unique=False)
+    # The purge worker deletes a sender's messages in chunks
+    op.create_index('ix_message_sender_id', 'message', ['sender_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_message_sender_id', table_name='message')
+    op.drop_index(op.f('ix_purge_job_status'), table_name='purge_job')
+    op.drop_index(op.f('ix_purge_job_target_id'), table_name='purge_job')
+    op.drop_table('purge_job')
+    op.drop_column('user', 'deleted_at')
+    op.drop_column('chat', 'deleted_at')
@@ -0,0 +1,46 @@
+"""Analytics rollup tables
+
+Revision ID: a9c3f5e27d18
+Revises: e2d8b6f41a7c
+Create Date: 2026-10-19 15:07:33.640215
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9c3f5e27d18'
+down_revision: Union[str, Sequence[str], None] = 'e2d8b6f41a7c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('message_daily_rollup',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('total', sa.Integer(), nullable=False),
+    sa.Column('pending_review', sa.Integer(), nullable=False),
+    sa.Column('approved', sa.Integer(), nullable=False),
+    sa.Column('rejected', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day')
+    )
+    op.create_table('chat_daily_rollup',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('chat_id', sa.Integer(), nullable=False),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'chat_id')
+    )
+    op.create_index(op.f('ix_chat_daily_rollup_day'), 'chat_daily_rollup', ['day'], unique=False)
+    op.create_index(op.f('ix_user_violation_count'), 'user', ['violation_count'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_user_violation_count'), table_name='user')
+    op.drop_index(op.f('ix_chat_daily_rollup_day'), table_name='chat_daily_rollup')
+    op.drop_table('chat_daily_rollup')
+    op.drop_table('message_daily_rollup')
@@ -0,0 +1,29 @@
+"""Message shard directory column on chat
+
+Revision ID: b61f0d93e4a2
+Revises: a9c3f5e27d18
+Create Date: 2026-10-19 16:21:05.118342
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b61f0d93e4a2'
+down_revision: Union[str, Sequence[str], None] = 'a9c3f5e27d18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # NULL = messages stay in this (global) database, which is every existing chat
+    op.add_column('chat', sa.Column('shard', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('chat', 'shard')
@@ -0,0 +1,140 @@
+"""Partition message by month and add archive manifest
+
+Revision ID: c47e9d0b2a15
+Revises: 8f3a2d61c0b4
+Create Date: 2026-10-19 12:26:05.917342
+
+"""
+from typing import Sequence, Union
+from datetime import datetime, date
+import sqlmodel
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c47e9d0b2a15'
+down_revision: Union[str, Sequence[str], None] = '8f3a2d61c0b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+
+
+# Kept in step with app.partitions, which creates later partitions at runtime
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def create_partition_sql(start: date) -> str:
+    end = add_months(start, 1)
+    return (
+        f"CREATE TABLE IF NOT EXISTS message_p{start.year:04d}_{start.month:02d} PARTITION OF message "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+
+MESSAGE_INDEXES = ('ix_message_violation_status', 'ix_message_chat_id_id', 'ix_message_sender_id')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('message_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('partition_name', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('range_start', sa.DateTime(), nullable=False),
+    sa.Column('range_end', sa.DateTime(), nullable=False),
+    sa.Column('path', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('row_count', sa.Integer(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('partition_name')
+    )
+    op.create_index(op.f('ix_message_archive_range_start'), 'message_archive', ['range_start'], unique=False)
+    op.create_table('message_archive_chat',
+    sa.Column('archive_id', sa.Integer(), nullable=False),
+    sa.Column('chat_id', sa.Integer(), nullable=False),
+    sa.Column('row_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['archive_id'], ['message_archive.id'], ),
+    sa.PrimaryKeyConstraint('archive_id', 'chat_id')
+    )
+    op.create_index(op.f('ix_message_archive_chat_chat_id'), 'message_archive_chat', ['chat_id'], unique=False)
+
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    # Swap the heap for a range-partitioned table; the partition key must be part of the PK
+    op.execute('ALTER TABLE message RENAME TO message_legacy')
+    op.execute('ALTER TABLE message_legacy RENAME CONSTRAINT message_pkey TO message_legacy_pkey')
+    for index in MESSAGE_INDEXES:
+        op.execute(f'ALTER INDEX {index} RENAME TO {index}_legacy')
+
+    op.execute('''
+        CREATE TABLE message (
+            id INTEGER NOT NULL DEFAULT nextval('message_id_seq'),
+            content VARCHAR NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            chat_id INTEGER REFERENCES chat (id),
+            violation_status VARCHAR NOT NULL,
+            sender_id INTEGER NOT NULL REFERENCES "user" (id),
+            CONSTRAINT message_pkey PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    ''')
+    op.execute('CREATE INDEX ix_message_violation_status ON message (violation_status)')
+    op.execute('CREATE INDEX ix_message_chat_id_id ON message (chat_id, id)')
+    op.execute('CREATE INDEX ix_message_sender_id ON message (sender_id)')
+
+    oldest = bind.execute(sa.text('SELECT min(created_at) FROM message_legacy')).scalar()
+    current = month_start(datetime.now().date())
+    start = month_start(oldest.date()) if oldest else current
+    while start <= add_months(current, MONTHS_AHEAD):
+        op.execute(create_partition_sql(start))
+        start = add_months(start, 1)
+
+    op.execute('''
+        INSERT INTO message (id, content, created_at, chat_id, violation_status, sender_id)
+        SELECT id, content, created_at, chat_id, violation_status, sender_id FROM message_legacy
+    ''')
+    op.execute('ALTER SEQUENCE message_id_seq OWNED BY message.id')
+    op.execute('DROP TABLE message_legacy')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute('ALTER TABLE message RENAME TO message_partitioned')
+        op.execute('ALTER TABLE message_partitioned RENAME CONSTRAINT message_pkey TO message_partitioned_pkey')
+        for index in MESSAGE_INDEXES:
+            op.execute(f'ALTER INDEX {index} RENAME TO {index}_partitioned')
+
+        op.execute('''
+            CREATE TABLE message (
+                id INTEGER NOT NULL DEFAULT nextval('message_id_seq'),
+                content VARCHAR NOT NULL,
+                created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+                chat_id INTEGER REFERENCES chat (id),
+                violation_status VARCHAR NOT NULL,
+                sender_id INTEGER NOT NULL REFERENCES "user" (id),
+                CONSTRAINT message_pkey PRIMARY KEY (id)
+            )
+        ''')
+        op.execute('''
+            INSERT INTO message (id, content, created_at, chat_id, violation_status, sender_id)
+            SELECT id, content, created_at, chat_id, violation_status, sender_id FROM message_partitioned
+        ''')
+        op.execute('ALTER SEQUENCE message_id_seq OWNED BY message.id')
+        op.execute('DROP TABLE message_partitioned CASCADE')
+        op.execute('CREATE INDEX ix_message_violation_status ON message (violation_status)')
+        op.execute('CREATE INDEX ix_message_chat_id_id ON message (chat_id, id)')
+        op.execute('CREATE INDEX ix_message_sender_id ON message (sender_id)')
+
+    op.drop_index(op.f('ix_message_archive_chat_chat_id'), table_name='message_archive_chat')
+    op.drop_table('message_archive_chat')
+    op.drop_index(op.f('ix_message_archive_range_start'), table_name='message_archive')
+    op.drop_table('message_archive')
@@ -0,0 +1,38 @@
+"""Widen message ids to BIGINT for per-shard id ranges
+
+Revision ID: d5a2c8e17b39
+Revises: b61f0d93e4a2
+Create Date: 2026-10-19 18:07:44.512903
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a2c8e17b39'
+down_revision: Union[str, Sequence[str], None] = 'b61f0d93e4a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # SQLite INTEGER is already 64-bit
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    # Rewrites every message partition; the sequence's implicit MAXVALUE follows the type
+    op.execute('ALTER TABLE message ALTER COLUMN id TYPE BIGINT')
+    op.execute('ALTER SEQUENCE message_id_seq AS BIGINT')
+    op.execute('ALTER TABLE chat_participant ALTER COLUMN last_read_message_id TYPE BIGINT')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('ALTER TABLE chat_participant ALTER COLUMN last_read_message_id TYPE INTEGER')
+    op.execute('ALTER SEQUENCE message_id_seq AS INTEGER MAXVALUE 2147483647')
+    op.execute('ALTER TABLE message ALTER COLUMN id TYPE INTEGER')
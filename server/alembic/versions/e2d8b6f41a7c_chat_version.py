@@ -0,0 +1,28 @@
+"""Chat version counter for conditional GETs
+
+Revision ID: e2d8b6f41a7c
+Revises: c47e9d0b2a15
+Create Date: 2026-10-19 13:48:52.301774
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2d8b6f41a7c'
+down_revision: Union[str, Sequence[str], None] = 'c47e9d0b2a15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chat', sa.Column('version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('chat', 'version')
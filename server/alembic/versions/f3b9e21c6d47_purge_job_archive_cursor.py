@@ -0,0 +1,28 @@
+"""Archive cursor on purge jobs
+
+Revision ID: f3b9e21c6d47
+Revises: d5a2c8e17b39
+Create Date: 2026-10-19 19:12:36.208114
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b9e21c6d47'
+down_revision: Union[str, Sequence[str], None] = 'd5a2c8e17b39'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('purge_job', sa.Column('archive_cursor', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('purge_job', 'archive_cursor')
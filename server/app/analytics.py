@@ -0,0 +1,199 @@
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Tuple
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, select, func
+import asyncio
+
+from app.config import settings
+from app.databases import engine
+from app.model import Chat, ChatDailyRollup, Message, MessageArchive, MessageDailyRollup
+from app.schemas import ViolationStatus
+from app import sharding
+
+
+# One counter column per moderation outcome, named after the ViolationStatus value
+STATUS_COLUMNS = tuple(status.value for status in ViolationStatus)
+
+
+def _upsert(model, keys, values):
+  """INSERT ... ON CONFLICT DO UPDATE adding the new counts onto the existing bucket"""
+  insert = pg_insert if engine.dialect.name == "postgresql" else sqlite_insert
+  statement = insert(model).values(values)
+  counters = {
+    column.name: getattr(model, column.name) + statement.excluded[column.name]
+    for column in model.__table__.columns if column.name not in keys
+  }
+  return statement.on_conflict_do_update(index_elements=keys, set_=counters)
+
+
+class RollupBuffer:
+  """Accumulates per-day message/moderation counters in memory and upserts them in batches"""
+
+  def __init__(self):
+    self.messages : Dict[Tuple[date, str], int] = {}
+    self.chats : Dict[Tuple[date, int], int] = {}
+    self._flusher : asyncio.Task | None = None
+
+  def record_message(self, message : Message):
+    day = message.created_at.date()
+    self._add_status(day, message.violation_status, 1)
+    if message.chat_id is not None:
+      self.chats[(day, message.chat_id)] = self.chats.get((day, message.chat_id), 0) + 1
+    self._ensure_flusher()
+
+  def record_deletion(self, message : Message):
+    """Takes a deleted message back out of its day's and chat's counters"""
+    self._remove(message.created_at, message.chat_id, message.violation_status)
+    self._ensure_flusher()
+
+  def _remove(self, created_at : datetime, chat_id : int | None, status : str):
+    day = created_at.date()
+    self._add_status(day, status, -1)
+    if chat_id is not None:
+      self.chats[(day, chat_id)] = self.chats.get((day, chat_id), 0) - 1
+
+  def record_status_change(self, message : Message, old_status : str):
+    """Moves one message between moderation buckets of the day it was created"""
+    if old_status == message.violation_status:
+      return
+    day = message.created_at.date()
+    self._add_status(day, old_status, -1, count_total=False)
+    self._add_status(day, message.violation_status, 1, count_total=False)
+    self._ensure_flusher()
+
+  def _add_status(self, day : date, status : str, delta : int, count_total : bool = True):
+    if count_total:
+      self.messages[(day, "total")] = self.messages.get((day, "total"), 0) + delta
+    if status in STATUS_COLUMNS:
+      self.messages[(day, status)] = self.messages.get((day, status), 0) + delta
+
+  def _write(self, messages, chats):
+    with Session(engine) as session:
+      _apply(session, messages, chats)
+      session.commit()
+
+  async def flush(self):
+    if not self.messages and not self.chats:
+      return
+    messages, chats = self.messages, self.chats
+    self.messages, self.chats = {}, {}
+    try:
+      await asyncio.to_thread(self._write, messages, chats)
+    except Exception:
+      # Put the counters back (on top of anything recorded meanwhile) for the next flush
+      for key, count in messages.items():
+        self.messages[key] = self.messages.get(key, 0) + count
+      for key, count in chats.items():
+        self.chats[key] = self.chats.get(key, 0) + count
+      raise
+
+  def _ensure_flusher(self):
+    if self._flusher is None or self._flusher.done():
+      self._flusher = asyncio.create_task(self._flush_loop())
+
+  async def _flush_loop(self):
+    while True:
+      await asyncio.sleep(settings.ANALYTICS_FLUSH_INTERVAL)
+      try:
+        await self.flush()
+      except Exception as e:
+        print(f"Error flushing analytics rollups: {e}")
+
+
+def _apply(session : Session, messages, chats):
+  days : Dict[date, dict] = {}
+  for (day, column), count in messages.items():
+    row = days.setdefault(day, {"day": day, "total": 0, **{column: 0 for column in STATUS_COLUMNS}})
+    row[column] += count
+  if days:
+    session.execute(_upsert(MessageDailyRollup, ["day"], list(days.values())))
+  if chats:
+    values = [{"day": day, "chat_id": chat_id, "message_count": count} for (day, chat_id), count in chats.items()]
+    session.execute(_upsert(ChatDailyRollup, ["day", "chat_id"], values))
+
+
+def subtract_purged(session : Session, rows : Iterable[Tuple[datetime, int | None, str]]):
+  """Takes purged messages, as (created_at, chat_id, violation_status), out of the rollups in the caller's transaction.
+  The purge worker's counterpart of record_deletion(), so a deletion counts the same however it happens."""
+  counts = RollupBuffer()
+  for created_at, chat_id, status in rows:
+    counts._remove(created_at, chat_id, status)
+  _apply(session, counts.messages, counts.chats)
+
+
+def _count_day(session : Session, lower : datetime, upper : datetime) -> Dict[Tuple[int | None, str], int]:
+  """Messages per (chat_id, violation_status) created in [lower, upper), across the global database and every shard"""
+  found = {}
+  for shard in [None, *range(len(sharding.shard_engines))]:
+    with Session(sharding.engine_for(shard)) as counting:
+      found[shard] = counting.exec(
+        select(Message.chat_id, Message.violation_status, func.count(Message.id))
+        .where(Message.created_at >= lower, Message.created_at < upper)
+        .group_by(Message.chat_id, Message.violation_status)
+      ).all()
+
+  chat_ids = {chat_id for rows in found.values() for chat_id, _, _ in rows if chat_id is not None}
+  locations = dict(session.exec(select(Chat.id, Chat.shard).where(Chat.id.in_(chat_ids))).all()) if sharding.enabled() and chat_ids else {}
+  counts : Dict[Tuple[int | None, str], int] = {}
+  for shard, rows in found.items():
+    for chat_id, status, count in rows:
+      # Skip the copy an unfinished move_chat() leaves outside the chat's current location
+      if chat_id is not None and locations.get(chat_id) != shard:
+        continue
+      counts[(chat_id, status)] = counts.get((chat_id, status), 0) + count
+  return counts
+
+
+def _recount_day(day : date) -> bool:
+  """Replaces one day's rollup rows with counts from the message tables of every database.
+  Returns False, leaving the rows alone, when the day is archived or has no messages."""
+  lower = datetime.combine(day, datetime.min.time())
+  upper = lower + timedelta(days=1)
+  with Session(engine) as session:
+    archived = session.exec(
+      select(MessageArchive.id).where(MessageArchive.range_start <= lower, MessageArchive.range_end > lower)
+    ).first()
+    if archived is not None:
+      return False
+    counts = _count_day(session, lower, upper)
+    if not counts:
+      return False
+    status_counts : Dict[str, int] = {}
+    chat_counts : Dict[int, int] = {}
+    for (chat_id, status), count in counts.items():
+      status_counts[status] = status_counts.get(status, 0) + count
+      if chat_id is not None:
+        chat_counts[chat_id] = chat_counts.get(chat_id, 0) + count
+
+    session.execute(delete(MessageDailyRollup).where(MessageDailyRollup.day == day))
+    session.execute(delete(ChatDailyRollup).where(ChatDailyRollup.day == day))
+    session.add(MessageDailyRollup(
+      day=day,
+      total=sum(status_counts.values()),
+      **{column: status_counts.get(column, 0) for column in STATUS_COLUMNS}
+    ))
+    for chat_id, count in chat_counts.items():
+      session.add(ChatDailyRollup(day=day, chat_id=chat_id, message_count=count))
+    session.commit()
+  return True
+
+
+def backfill_rollups(start : date, end : date):
+  """Recomputes rollups for [start, end] from the message tables, one day per transaction.
+
+  Meant for closed days: a day that is still receiving messages is also counted
+  by the live buffer. Days whose messages were archived, or that have no
+  messages left to count, keep their existing rollup rows.
+  """
+  day = start
+  while day <= end:
+    if _recount_day(day):
+      print(f"Backfilled rollups for {day.isoformat()}")
+    else:
+      print(f"Kept existing rollups for {day.isoformat()} (archived or no live messages)")
+    day += timedelta(days=1)
+
+
+rollups = RollupBuffer()
@@ -0,0 +1,114 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Iterable, Iterator, List, Tuple
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import Session, select
+import csv
+import json
+import multiprocessing
+import os
+
+from app.config import settings
+from app.databases import engine
+from app.model import User
+from app.schemas import UserCreate
+from app.utils import pwd_context
+
+
+def hash_password(password : str) -> str:
+  """Top-level so it can be pickled into worker processes"""
+  return pwd_context.hash(password)
+
+
+def read_rows(stream : IO[str], fmt : str) -> Iterator[Tuple[int, dict]]:
+  """Yields (row_number, raw_row) from a CSV (with header) or JSONL stream"""
+  if fmt == "csv":
+    for number, row in enumerate(csv.DictReader(stream), start=2):
+      yield number, row
+    return
+  for number, line in enumerate(stream, start=1):
+    if not line.strip():
+      continue
+    try:
+      row = json.loads(line)
+    except ValueError as e:
+      row = {"__error__": f"Invalid JSON: {e}"}
+    yield number, row if isinstance(row, dict) else {"__error__": "Expected a JSON object"}
+
+
+def _insert_users(session : Session, values : List[dict]) -> set:
+  """Multi-row INSERT returning the emails that were actually created"""
+  if engine.dialect.name == "postgresql":
+    # A concurrent signup can still win the race for an email; let the unique index decide
+    statement = pg_insert(User).values(values).on_conflict_do_nothing(index_elements=["email"]).returning(User.email)
+    return set(session.execute(statement).scalars().all())
+  session.execute(insert(User).values(values))
+  return {value["email"] for value in values}
+
+
+def import_users(rows : Iterable[Tuple[int, dict]], batch_size : int | None = None, workers : int | None = None) -> dict:
+  """Validates, de-duplicates, hashes and inserts users in batches.
+
+  Returns created/skipped/failed counts plus a report entry for every row that
+  was not created.
+  """
+  batch_size = batch_size or settings.BULK_IMPORT_BATCH_SIZE
+  summary = {"created": 0, "skipped": 0, "failed": 0, "errors": []}
+  seen = set()
+
+  def report(number, email, row_status, error):
+    summary[row_status] += 1
+    # Raw rows can carry any JSON value as the email; the report always holds a string
+    summary["errors"].append({"row": number, "email": None if email is None else str(email), "status": row_status, "error": error})
+
+  def flush(batch, pool, session):
+    emails = [user.email for _, user in batch]
+    existing = set(session.exec(select(User.email).where(User.email.in_(emails))).all())
+    fresh = []
+    for number, user in batch:
+      if user.email in existing:
+        report(number, user.email, "skipped", "Email already registered")
+      else:
+        fresh.append((number, user))
+    if not fresh:
+      return
+
+    hashes = pool.map(hash_password, [user.password for _, user in fresh], chunksize=max(1, len(fresh) // ((workers or os.cpu_count() or 1) * 4)))
+    # Core inserts bypass model defaults, so every NOT NULL column is spelled out
+    values = [
+      {"name": user.name, "email": user.email, "password": hashed, "is_admin": False, "violation_count": 0, "is_banned": False}
+      for (_, user), hashed in zip(fresh, hashes)
+    ]
+    created = _insert_users(session, values)
+    session.commit()
+    for number, user in fresh:
+      if user.email in created:
+        summary["created"] += 1
+      else:
+        report(number, user.email, "skipped", "Email already registered")
+
+  # spawn, not fork: forking a process that runs an event loop and holds pooled DB connections is unsafe
+  with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool, Session(engine) as session:
+    batch = []
+    for number, row in rows:
+      if "__error__" in row:
+        report(number, None, "failed", row["__error__"])
+        continue
+      try:
+        user = UserCreate(**row)
+      except (ValidationError, TypeError) as e:
+        report(number, row.get("email"), "failed", str(e))
+        continue
+      if user.email in seen:
+        report(number, user.email, "skipped", "Duplicate email in import file")
+        continue
+      seen.add(user.email)
+      batch.append((number, user))
+      if len(batch) >= batch_size:
+        flush(batch, pool, session)
+        batch = []
+    if batch:
+      flush(batch, pool, session)
+
+  return summary
@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings
+from typing import List
 
 class Settings(BaseSettings):
   DATABASE_URL : str
@@ -6,6 +7,83 @@ class Settings(BaseSettings):
   ALGORITHM : str
   ACCESS_TOKEN_EXPIRE_MINUTES : int
   
+  # Optional message shards (JSON list of database URLs, see app.sharding). Empty
+  # keeps every message in DATABASE_URL. Shard k allocates message ids from
+  # (k + 1) * SHARD_ID_SPAN up to the next range, the global database below
+  # SHARD_ID_SPAN, so ids stay unique across databases (message ids are BIGINT).
+  SHARD_DATABASE_URLS : List[str] = []
+  SHARD_ID_SPAN : int = 2**40
+  
+  # Optional read replica; reads fall back to the primary after a user's own
+  # writes and whenever replication lag exceeds the threshold
+  READ_DATABASE_URL : str | None = None
+  REPLICA_PIN_SECONDS : float = 5.0
+  REPLICA_MAX_LAG_SECONDS : float = 2.0
+  REPLICA_LAG_CHECK_INTERVAL : float = 1.0
+  
+  # Opt-in SQL instrumentation (see app.instrumentation)
+  QUERY_INSTRUMENTATION : bool = False
+  SLOW_QUERY_MS : float = 200.0
+  EXPLAIN_SLOW_QUERIES : bool = True
+  EXPLAIN_ANALYZE : bool = False
+  N_PLUS_ONE_THRESHOLD : int = 5
+  QUERY_BUDGET_STRICT : bool = False
+  
+  # Ephemeral presence / typing state kept on the WebSocket manager
+  PRESENCE_FLUSH_INTERVAL : float = 1.0
+  TYPING_TIMEOUT : float = 5.0
+  READ_MARK_FLUSH_INTERVAL : float = 1.0
+  
+  # Server-driven heartbeats: ping after this much silence, reap if no reply in time
+  WS_HEARTBEAT_INTERVAL : float = 30.0
+  WS_HEARTBEAT_TIMEOUT : float = 10.0
+  WS_HEARTBEAT_TICK : float = 1.0
+  
+  # Rooms one multiplexed (/messages/ws) socket may subscribe to
+  WS_MAX_SUBSCRIPTIONS : int = 500
+  
+  # Graceful drain before restarts: clients reconnect after a random delay up
+  # to DRAIN_RECONNECT_MAX_DELAY; the whole drain gives up after DRAIN_TIMEOUT
+  DRAIN_RECONNECT_MAX_DELAY : float = 15.0
+  DRAIN_TIMEOUT : float = 25.0
+  
+  # Binary (MessagePack) WebSocket frames at least this large are deflated
+  WS_COMPRESS_THRESHOLD : int = 512
+  WS_COMPRESS_LEVEL : int = 6
+  # Largest inbound client frame accepted, measured after inflating
+  WS_MAX_INBOUND_FRAME_BYTES : int = 65536
+  
+  # Background purge of deleted chats and users
+  PURGE_CHUNK_SIZE : int = 1000
+  PURGE_THROTTLE_SECONDS : float = 0.1
+  PURGE_POLL_INTERVAL : float = 5.0
+  
+  # Time-partitioned message storage (PostgreSQL only)
+  MESSAGE_PARTITION_MONTHS_AHEAD : int = 3
+  MESSAGE_ARCHIVE_AFTER_MONTHS : int = 12
+  # Must be storage every node mounts at the same path (the manifest is in the
+  # database); nodes that can't reach the listed archives refuse to start
+  MESSAGE_ARCHIVE_DIR : str = "archive"
+  PARTITION_MAINTENANCE_INTERVAL : float = 3600.0
+  
+  # Rows fetched per round trip by the server-side cursor used for exports
+  EXPORT_CHUNK_SIZE : int = 2000
+  
+  # Moderation pipeline; without a blocklist or classifier messages stay pending_review
+  MODERATION_BLOCKLIST_PATH : str | None = None
+  MODERATION_CACHE_SIZE : int = 10000
+  
+  # Seconds between upserts of buffered analytics rollup counters
+  ANALYTICS_FLUSH_INTERVAL : float = 5.0
+  
+  # Users validated, hashed and inserted per round trip by the bulk importer
+  BULK_IMPORT_BATCH_SIZE : int = 1000
+  # Larger files go through the import_users.py CLI instead of an HTTP request
+  BULK_IMPORT_MAX_HTTP_ROWS : int = 10000
+  
+  # Users one bulk add/remove participants request may name (ids and emails together)
+  BULK_PARTICIPANTS_MAX : int = 200
+  
   class Config:
     env_file = ".env"
     
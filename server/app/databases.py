@@ -1,10 +1,20 @@
 from sqlmodel import SQLModel,create_engine,Session
 
 from app.config import settings
+from app import instrumentation
 
 engine = create_engine(settings.DATABASE_URL)
 
+# Optional streaming replica for read-only endpoints (see app.replica)
+read_engine = create_engine(settings.READ_DATABASE_URL) if settings.READ_DATABASE_URL else None
+
+# Opt-in per-request query counting, slow-query EXPLAIN capture and N+1 detection
+if settings.QUERY_INSTRUMENTATION:
+  instrumentation.install(engine)
+  if read_engine is not None:
+    instrumentation.install(read_engine)
+
 def get_session():
   with Session(engine) as session:
     yield session
-    
\ No newline at end of file
+    
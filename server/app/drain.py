@@ -0,0 +1,36 @@
+import asyncio
+
+from app.analytics import rollups
+from app.config import settings
+from app.read_state import read_marks
+from app.websockets import manager
+
+
+async def drain_node(timeout : float | None = None) -> dict:
+  """Takes this node out of service without dropping work.
+
+  Readiness flips to 503 and new sockets are refused immediately; existing
+  sockets get a jittered reconnect frame and a 1012 close, bounded by
+  `timeout`. Buffered read marks and analytics counters are then written out
+  whether or not the socket drain finished. Never raises, so shutdown code
+  after it always runs. Safe to call more than once.
+  """
+  timeout = settings.DRAIN_TIMEOUT if timeout is None else timeout
+  manager.draining = True
+  result = {"draining": True, "completed": True, "sockets_closed": 0}
+  try:
+    result["sockets_closed"] = await asyncio.wait_for(manager.drain(settings.DRAIN_RECONNECT_MAX_DELAY), timeout)
+  except asyncio.TimeoutError:
+    print(f"Socket drain did not finish within {timeout}s")
+    result["completed"] = False
+  except Exception as e:
+    print(f"Error draining sockets: {e}")
+    result["completed"] = False
+
+  for name, buffer in (("read marks", read_marks), ("analytics rollups", rollups)):
+    try:
+      await buffer.flush()
+    except Exception as e:
+      print(f"Error flushing {name} during drain: {e}")
+      result["completed"] = False
+  return result
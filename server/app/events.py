@@ -0,0 +1,53 @@
+from typing import Any, List, Set
+
+from app.model import User
+from app.websockets import manager
+
+
+# Bumped whenever an event payload changes shape incompatibly
+EVENT_VERSION = 1
+
+
+def chat_event(event_type : str, chat_id : int, chat_version : int, **fields : Any) -> dict:
+  """Small delta event a client can apply in place.
+
+  `chat_version` matches the chat's ETag version, so a client that sees a gap
+  knows it missed an event and should refetch once.
+  """
+  return {"type": event_type, "v": EVENT_VERSION, "chat_id": chat_id, "chat_version": chat_version, **fields}
+
+def user_summary(user : User) -> dict:
+  return {"id": user.id, "name": user.name, "email": user.email}
+
+
+async def publish(event : dict, exclude_user_ids : Set[int] = frozenset()):
+  """Sends an event to everyone connected to its chat. Call only after commit."""
+  await manager.broadcast(event, event["chat_id"], exclude_user_ids)
+
+async def publish_participant_added(chat_id : int, chat_version : int, user : User):
+  event = chat_event("participant_added", chat_id, chat_version, user=user_summary(user))
+  await publish(event)
+  # The new member is not in the room yet; reach their sockets directly
+  await manager.send_to_user(user.id, event)
+
+async def publish_participant_removed(chat_id : int, chat_version : int, user_id : int):
+  event = chat_event("participant_removed", chat_id, chat_version, user_id=user_id)
+  # The removed user gets exactly one copy on each socket, through send_to_user
+  await publish(event, {user_id})
+  await manager.send_to_user(user_id, event)
+  await manager.remove_user_from_room(user_id, chat_id)
+
+async def publish_participants_changed(chat_id : int, chat_version : int, added : List[User], removed : List[int]):
+  """One room frame for a bulk membership change instead of one event per user"""
+  event = chat_event("participants_changed", chat_id, chat_version, added=[user_summary(u) for u in added], removed=removed)
+  # Users addressed directly below are left out of the room broadcast so nobody gets it twice
+  await publish(event, {u.id for u in added} | set(removed))
+  for user in added:
+    await manager.send_to_user(user.id, event)
+  for user_id in removed:
+    await manager.send_to_user(user_id, event)
+    await manager.remove_user_from_room(user_id, chat_id)
+
+async def publish_chat_deleted(chat_id : int, chat_version : int):
+  await publish(chat_event("chat_deleted", chat_id, chat_version))
+  await manager.close_room(chat_id)
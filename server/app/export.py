@@ -0,0 +1,101 @@
+from typing import Iterable, Iterator
+from sqlmodel import Session, select
+import csv
+import heapq
+import io
+import json
+import zlib
+
+from app.config import settings
+from app.databases import engine
+from app.model import Chat, Message
+from app.partitions import iter_archived_messages, iter_archived_messages_by_sender
+from app import sharding
+
+
+EXPORT_FIELDS = ["id", "chat_id", "sender_id", "created_at", "violation_status", "content"]
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _iter_live_rows(shard : int | None, condition) -> Iterator[dict]:
+  statement = (
+    select(*(getattr(Message, field) for field in EXPORT_FIELDS))
+    .where(condition)
+    .order_by(Message.id)
+    .execution_options(yield_per=settings.EXPORT_CHUNK_SIZE)
+  )
+  with Session(sharding.engine_for(shard)) as session:
+    for row in session.exec(statement):
+      yield dict(row._mapping)
+
+
+def iter_message_rows(chat_id : int | None = None, sender_id : int | None = None) -> Iterator[dict]:
+  """Yields a chat's or user's messages, archived history first, through server-side cursors.
+
+  Rows are plain column tuples (no ORM identity map), so memory stays flat however
+  long the history is. A chat's live rows come from its shard; a user's are
+  merged by id across the global database and every shard.
+  """
+  with Session(engine) as session:
+    if chat_id is not None:
+      archived = iter_archived_messages(session, chat_id)
+      shard = session.exec(select(Chat.shard).where(Chat.id == chat_id)).first()
+      live = _iter_live_rows(shard, Message.chat_id == chat_id)
+    else:
+      archived = iter_archived_messages_by_sender(session, sender_id)
+      live = heapq.merge(
+        *(_iter_live_rows(shard, Message.sender_id == sender_id) for shard in [None, *range(len(sharding.shard_engines))]),
+        key=lambda row: row["id"]
+      )
+
+    for record in archived:
+      yield {field: record[field] for field in EXPORT_FIELDS}
+
+    last_id = None
+    for row in live:
+      # A chat being moved between databases briefly has its rows in both
+      if row["id"] != last_id:
+        yield row
+      last_id = row["id"]
+
+
+def _ndjson_lines(rows : Iterable[dict]) -> Iterator[str]:
+  for row in rows:
+    row["created_at"] = row["created_at"].isoformat()
+    yield json.dumps(row) + "\n"
+
+def _csv_lines(rows : Iterable[dict]) -> Iterator[str]:
+  buffer = io.StringIO()
+  writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+  writer.writeheader()
+  for row in rows:
+    row["created_at"] = row["created_at"].isoformat()
+    writer.writerow(row)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+  yield buffer.getvalue()
+
+
+def export_stream(rows : Iterable[dict], fmt : str = "ndjson", compress : bool = False) -> Iterator[bytes]:
+  """Encodes rows as NDJSON or CSV in ~64KB chunks, optionally gzipped on the fly"""
+  lines = _csv_lines(rows) if fmt == "csv" else _ndjson_lines(rows)
+  compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 -> gzip container
+
+  pending, size = [], 0
+  for line in lines:
+    pending.append(line)
+    size += len(line)
+    if size >= 65536:
+      chunk = "".join(pending).encode("utf-8")
+      pending, size = [], 0
+      chunk = compressor.compress(chunk) if compressor else chunk
+      if chunk:
+        yield chunk
+
+  chunk = "".join(pending).encode("utf-8")
+  if compressor:
+    chunk = compressor.compress(chunk) + compressor.flush()
+  if chunk:
+    yield chunk
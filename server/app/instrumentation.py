@@ -0,0 +1,116 @@
+from collections import Counter
+from contextvars import ContextVar
+from typing import List
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import re
+import time
+
+from app.config import settings
+
+
+class QueryBudgetExceeded(Exception):
+  """Raised (in strict mode) when a request runs more queries than its route allows"""
+
+
+class RequestQueryStats:
+  __slots__ = ("count", "total_time", "shapes", "budget", "slow")
+
+  def __init__(self):
+    self.count = 0
+    self.total_time = 0.0
+    self.shapes : Counter = Counter()
+    self.budget : int | None = None
+    self.slow : List[str] = []
+
+
+_request_stats : ContextVar[RequestQueryStats | None] = ContextVar("request_query_stats", default=None)
+_explaining : ContextVar[bool] = ContextVar("explaining_query", default=False)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_IN_LISTS = re.compile(r"\bIN\s*\([^)]*\)", re.IGNORECASE)
+_SPACES = re.compile(r"\s+")
+
+
+def statement_shape(statement : str) -> str:
+  """Collapses literals, IN-lists and whitespace so repeated lazy loads share one shape"""
+  shape = _IN_LISTS.sub("IN (...)", statement)
+  shape = _LITERALS.sub("?", shape)
+  return _SPACES.sub(" ", shape).strip()
+
+
+def begin_request() -> RequestQueryStats:
+  stats = RequestQueryStats()
+  _request_stats.set(stats)
+  return stats
+
+def current_stats() -> RequestQueryStats | None:
+  return _request_stats.get()
+
+
+def query_budget(limit : int):
+  """Route dependency declaring the most queries one request may run, e.g.
+  `dependencies=[Depends(query_budget(5))]`"""
+  def set_budget():
+    stats = _request_stats.get()
+    if stats is not None:
+      stats.budget = limit
+  return set_budget
+
+
+def _explain(conn, statement : str, parameters):
+  if conn.dialect.name == "postgresql":
+    prefix = "EXPLAIN (ANALYZE, BUFFERS) " if settings.EXPLAIN_ANALYZE else "EXPLAIN "
+  elif conn.dialect.name == "sqlite":
+    prefix = "EXPLAIN QUERY PLAN "
+  else:
+    return None
+  token = _explaining.set(True)
+  try:
+    with conn.engine.connect() as explain_conn:
+      rows = explain_conn.exec_driver_sql(prefix + statement, parameters).all()
+    return "\n".join(" ".join(str(col) for col in row) for row in rows)
+  except Exception as e:
+    return f"EXPLAIN failed: {e}"
+  finally:
+    _explaining.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  elapsed = time.perf_counter() - conn.info["query_start"].pop()
+  if _explaining.get():
+    return
+
+  stats = _request_stats.get()
+  if stats is not None:
+    stats.count += 1
+    stats.total_time += elapsed
+    stats.shapes[statement_shape(statement)] += 1
+
+  if elapsed * 1000 >= settings.SLOW_QUERY_MS:
+    print(f"Slow query ({elapsed * 1000:.1f} ms): {statement} {parameters if not executemany else '[executemany]'}")
+    if stats is not None:
+      stats.slow.append(statement)
+    # EXPLAIN ANALYZE executes the statement again, so only plain SELECTs are explained
+    if settings.EXPLAIN_SLOW_QUERIES and not executemany and statement.lstrip().upper().startswith("SELECT"):
+      print(f"Plan:\n{_explain(conn, statement, parameters)}")
+
+  if stats is not None and stats.budget is not None and stats.count > stats.budget and settings.QUERY_BUDGET_STRICT:
+    raise QueryBudgetExceeded(f"Query budget of {stats.budget} exceeded: {statement_shape(statement)}")
+
+
+def report(stats : RequestQueryStats, route : str):
+  """Logs N+1 suspects and budget overruns for a finished request"""
+  for shape, count in stats.shapes.items():
+    if count >= settings.N_PLUS_ONE_THRESHOLD:
+      print(f"Possible N+1 in {route}: {count}x {shape}")
+  if stats.budget is not None and stats.count > stats.budget:
+    print(f"Query budget exceeded in {route}: {stats.count} queries (budget {stats.budget})")
+
+
+def install(engine : Engine):
+  event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+  event.listen(engine, "after_cursor_execute", _after_cursor_execute)
@@ -1,12 +1,33 @@
-from fastapi import FastAPI,status
+from fastapi import FastAPI,status,Request,Response
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import chats,users,messages,auth
+from contextlib import asynccontextmanager
+import asyncio
+from app.routes import chats,users,messages,auth,admin
+from app.purge import purge_worker
+from app.partitions import check_archive_storage,partition_maintainer
+from app.replica import PIN_HEADER,pin_to_primary,request_user_id
+from app.config import settings
+from app import instrumentation
+from app.drain import drain_node
+from app.websockets import manager
 
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Archive files must be on storage every node shares with the manifest; refuse to start otherwise
+    await asyncio.to_thread(check_archive_storage)
+    purge_task = asyncio.create_task(purge_worker.run())
+    partition_task = asyncio.create_task(partition_maintainer.run())
+    yield
+    # Usually already done through POST /admin/drain before the signal; this
+    # still writes out buffered read marks and counters on a plain shutdown
+    await drain_node()
+    purge_task.cancel()
+    partition_task.cancel()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -15,14 +36,44 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[PIN_HEADER],
 )
 
+@app.middleware("http")
+async def pin_writers_to_primary(request: Request, call_next):
+    response = await call_next(request)
+    # After a successful write, route that client's reads to the primary for a while
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        if request_user_id(request) is not None:
+            pin_to_primary(response)
+    return response
+
+
+if settings.QUERY_INSTRUMENTATION:
+    @app.middleware("http")
+    async def count_queries(request: Request, call_next):
+        stats = instrumentation.begin_request()
+        response = await call_next(request)
+        route = request.scope.get("route")
+        instrumentation.report(stats, f"{request.method} {route.path if route else request.url.path}")
+        response.headers["X-Query-Count"] = str(stats.count)
+        return response
+
 
 @app.get('/',status_code=status.HTTP_200_OK)
 def read_root():
     return {"message": "Welcome to the AI CHAT application!"}
 
+@app.get('/ready',status_code=status.HTTP_200_OK)
+def readiness(response: Response):
+    """Load balancer readiness probe: 503 once the node is draining"""
+    if manager.draining:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "draining"}
+    return {"status": "ready"}
+
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(messages.router)
-app.include_router(chats.router)
\ No newline at end of file
+app.include_router(chats.router)
+app.include_router(admin.router)
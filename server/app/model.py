@@ -1,11 +1,18 @@
-from sqlmodel import SQLModel,Field,Relationship
+from sqlmodel import SQLModel,Field,Relationship,Index
+from sqlalchemy import BigInteger,Integer
 from typing import Optional,List
-from datetime import datetime,timezone
+from datetime import datetime,timezone,date
+
+# Message ids span several databases' id ranges (app.sharding). SQLite keeps
+# INTEGER, which is already 64-bit and the only type that autoincrements.
+MessageId = BigInteger().with_variant(Integer(),"sqlite")
 
 class ChatParticipant(SQLModel,table=True):
   __tablename__ = "chat_participant"
   user_id :Optional[int] = Field(default=None,primary_key=True,foreign_key="user.id")
   chat_id : Optional[int] = Field(default=None,primary_key=True,foreign_key="chat.id")
+  # High-water mark of the newest message this participant has read
+  last_read_message_id : Optional[int] = Field(default=None,sa_type=MessageId)
   
 
 class User(SQLModel,table=True):
@@ -16,8 +23,10 @@ class User(SQLModel,table=True):
   password : str
   
   is_admin : bool = Field(default=False)
-  violation_count : int = Field(default=0)
+  violation_count : int = Field(default=0,index=True)
   is_banned : bool = Field(default=False)
+  # Set on logical delete; rows are removed later by the purge worker
+  deleted_at : Optional[datetime] = Field(default=None)
   
   
   chats : List["Chat"] = Relationship(back_populates="participants",link_model=ChatParticipant)
@@ -30,19 +39,81 @@ class Chat(SQLModel,table=True):
   id : Optional[int] = Field(default=None,primary_key=True)
   title : str = Field(default="New Chat")
   created_at : datetime = Field(default=datetime.now(timezone.utc))
+  deleted_at : Optional[datetime] = Field(default=None)
+  # Bumped on every message, membership or title change; used for ETags
+  version : int = Field(default=0)
+  # Message shard (app.sharding); None keeps the messages in the global database
+  shard : Optional[int] = Field(default=None)
   
   participants : List[User] = Relationship(back_populates="chats",link_model=ChatParticipant)
   messages : List["Message"] = Relationship(back_populates="chat")
   
 class Message(SQLModel,table=True):
   __tablename__ = "message"
-  id : Optional[int] = Field(default=None,primary_key=True)
+  __table_args__ = (Index("ix_message_chat_id_id","chat_id","id"),)
+  # On PostgreSQL the table is range-partitioned by created_at and the physical
+  # primary key is (id, created_at); id alone stays unique via its sequence.
+  id : Optional[int] = Field(default=None,primary_key=True,sa_type=MessageId)
   content : str
-  created_at : datetime = Field(default=datetime.now())
+  created_at : datetime = Field(default_factory=datetime.now)
   
   chat_id : Optional[int] = Field(default=None,foreign_key="chat.id")
   violation_status : str = Field(default="pending_review",index=True)
   chat : Optional[Chat] = Relationship(back_populates="messages") 
-  sender_id : int = Field(foreign_key="user.id")
+  sender_id : int = Field(foreign_key="user.id",index=True)
   sender : User = Relationship(back_populates="messages")
-  
\ No newline at end of file
+
+
+class PurgeJob(SQLModel,table=True):
+  """Background removal of a logically deleted chat or user, processed in chunks"""
+  __tablename__ = "purge_job"
+  id : Optional[int] = Field(default=None,primary_key=True)
+  kind : str  # "chat" or "user"
+  target_id : int = Field(index=True)
+  status : str = Field(default="pending",index=True)
+  messages_deleted : int = Field(default=0)
+  participants_deleted : int = Field(default=0)
+  # Last MessageArchive.id already purged of a user's archived messages
+  archive_cursor : Optional[int] = Field(default=None)
+  error : Optional[str] = Field(default=None)
+  created_at : datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+  updated_at : datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+  finished_at : Optional[datetime] = Field(default=None)
+
+
+class MessageArchive(SQLModel,table=True):
+  """A message partition that was moved to a compressed JSONL file"""
+  __tablename__ = "message_archive"
+  id : Optional[int] = Field(default=None,primary_key=True)
+  partition_name : str = Field(unique=True)
+  range_start : datetime = Field(index=True)
+  range_end : datetime
+  path : str
+  row_count : int = Field(default=0)
+  archived_at : datetime = Field(default_factory=datetime.now)
+
+
+class MessageArchiveChat(SQLModel,table=True):
+  """Per-chat row counts inside an archive, used to page into archived history"""
+  __tablename__ = "message_archive_chat"
+  archive_id : int = Field(primary_key=True,foreign_key="message_archive.id")
+  chat_id : int = Field(primary_key=True,index=True)
+  row_count : int = Field(default=0)
+
+
+class MessageDailyRollup(SQLModel,table=True):
+  """Messages created per day, split by moderation outcome"""
+  __tablename__ = "message_daily_rollup"
+  day : date = Field(primary_key=True)
+  total : int = Field(default=0)
+  pending_review : int = Field(default=0)
+  approved : int = Field(default=0)
+  rejected : int = Field(default=0)
+
+
+class ChatDailyRollup(SQLModel,table=True):
+  """Messages created per chat per day"""
+  __tablename__ = "chat_daily_rollup"
+  day : date = Field(primary_key=True,index=True)
+  chat_id : int = Field(primary_key=True)
+  message_count : int = Field(default=0)
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from typing import Callable, Dict, FrozenSet, Tuple
+import re
+import time
+import unicodedata
+
+from app.config import settings
+from app.schemas import ViolationStatus
+
+
+STAGES = ("normalize", "blocklist", "cache", "model")
+
+_ZERO_WIDTH = dict.fromkeys(map(ord, "\u200b\u200c\u200d\u2060\ufeff"))
+_LEET = str.maketrans({"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "@": "a", "$": "s"})
+_REPEATS = re.compile(r"(.)\1{2,}")
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text : str) -> str:
+  """Folds the usual evasions (case, width, zero-width chars, leetspeak, stretched letters)"""
+  text = unicodedata.normalize("NFKC", text).translate(_ZERO_WIDTH).casefold().translate(_LEET)
+  text = _REPEATS.sub(r"\1\1", text)
+  text = _NON_WORD.sub(" ", text)
+  return _SPACES.sub(" ", text).strip()
+
+
+def load_blocklist(path : str | None) -> Tuple[FrozenSet[str], Tuple[str, ...]]:
+  """Returns (single-word terms, multi-word phrases), both normalized"""
+  if not path:
+    return frozenset(), ()
+  with open(path, encoding="utf-8") as f:
+    terms = {normalize(line) for line in f if line.strip() and not line.startswith("#")}
+  return frozenset(t for t in terms if " " not in t), tuple(t for t in terms if " " in t)
+
+
+class Moderator:
+  """Decides Message.violation_status: normalize -> blocklist -> cache -> model.
+
+  Without a blocklist hit or a configured classifier a message stays
+  pending_review, so an unconfigured deployment behaves as before.
+  """
+
+  def __init__(self, blocklist_path : str | None = None, cache_size : int | None = None, classifier : Callable[[str], str] | None = None):
+    self.words, self.phrases = load_blocklist(blocklist_path)
+    self.cache_size = settings.MODERATION_CACHE_SIZE if cache_size is None else cache_size
+    self.cache : OrderedDict[str, str] = OrderedDict()
+    self.classifier = classifier
+
+  def moderate(self, text : str, timings : Dict[str, float] | None = None) -> str:
+    """Returns a ViolationStatus value; adds per-stage seconds to `timings` when given"""
+    clock = time.perf_counter
+    started = clock()
+    normalized = normalize(text)
+    stage_end = clock()
+    if timings is not None:
+      timings["normalize"] = timings.get("normalize", 0.0) + stage_end - started
+
+    started = stage_end
+    padded = f" {normalized} "
+    blocked = any(word in self.words for word in normalized.split()) or any(f" {p} " in padded for p in self.phrases)
+    stage_end = clock()
+    if timings is not None:
+      timings["blocklist"] = timings.get("blocklist", 0.0) + stage_end - started
+    if blocked:
+      return ViolationStatus.REJECTED.value
+
+    started = stage_end
+    cached = self.cache.get(normalized)
+    if cached is not None:
+      self.cache.move_to_end(normalized)
+    stage_end = clock()
+    if timings is not None:
+      timings["cache"] = timings.get("cache", 0.0) + stage_end - started
+    if cached is not None:
+      return cached
+
+    started = stage_end
+    decision = self.classifier(normalized) if self.classifier else ViolationStatus.PENDING_REVIEW.value
+    stage_end = clock()
+    if timings is not None:
+      timings["model"] = timings.get("model", 0.0) + stage_end - started
+
+    if self.cache_size:
+      self.cache[normalized] = decision
+      if len(self.cache) > self.cache_size:
+        self.cache.popitem(last=False)
+    return decision
+
+
+moderator = Moderator(settings.MODERATION_BLOCKLIST_PATH)
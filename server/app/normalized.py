@@ -0,0 +1,67 @@
+from typing import Dict, Iterable, List, Sequence
+from sqlmodel import Session, select
+
+from app.model import Chat, ChatParticipant, Message, User
+from app.schemas import ChatRead, ChatReadNormalized, MessageRead, MessageReadCompact, UserRead
+from app.sharding import engine_for
+
+
+def users_by_id(db : Session, user_ids : Iterable[int]) -> Dict[int, UserRead]:
+  """One bulk fetch for every user a response references"""
+  user_ids = set(user_ids)
+  if not user_ids:
+    return {}
+  return {user.id: UserRead.model_validate(user) for user in db.exec(select(User).where(User.id.in_(user_ids))).all()}
+
+
+def normalized_chat(db : Session, chat : Chat) -> ChatReadNormalized:
+  """ChatRead without nested users: never touches chat.participants or message.sender"""
+  participant_ids = db.exec(select(ChatParticipant.user_id).where(ChatParticipant.chat_id == chat.id)).all()
+  statement = select(Message).where(Message.chat_id == chat.id).order_by(Message.created_at.asc())
+  if chat.shard is None:
+    messages = [MessageReadCompact.model_validate(m) for m in db.exec(statement).all()]
+  else:
+    with Session(engine_for(chat.shard)) as shard_session:
+      messages = [MessageReadCompact.model_validate(m) for m in shard_session.exec(statement).all()]
+  return ChatReadNormalized(
+    id=chat.id,
+    title=chat.title,
+    created_at=chat.created_at,
+    participant_ids=sorted(participant_ids),
+    messages=messages,
+    users=users_by_id(db, [*participant_ids, *(m.sender_id for m in messages)])
+  )
+
+
+def chat_reads(db : Session, chats : Sequence[Chat], schema = ChatRead) -> List[ChatRead]:
+  """`schema` (ChatRead or a subclass) for each chat, with messages read from wherever they live.
+
+  Unsharded chats validate straight from the ORM as before. Sharded chats get
+  one message query per shard and one bulk fetch of their senders from the
+  global database.
+  """
+  by_shard : Dict[int, List[int]] = {}
+  for chat in chats:
+    if chat.shard is not None:
+      by_shard.setdefault(chat.shard, []).append(chat.id)
+  messages : Dict[int, List[dict]] = {}
+  for shard, chat_ids in by_shard.items():
+    with Session(engine_for(shard)) as shard_session:
+      statement = select(Message).where(Message.chat_id.in_(chat_ids)).order_by(Message.created_at.asc())
+      for message in shard_session.exec(statement).all():
+        messages.setdefault(message.chat_id, []).append(message.model_dump())
+  senders = users_by_id(db, (row["sender_id"] for rows in messages.values() for row in rows))
+
+  reads = []
+  for chat in chats:
+    if chat.shard is None:
+      reads.append(schema.model_validate(chat))
+      continue
+    reads.append(schema(
+      id=chat.id,
+      title=chat.title,
+      created_at=chat.created_at,
+      participants=[UserRead.model_validate(user) for user in chat.participants],
+      messages=[MessageRead(**row, sender=senders[row["sender_id"]]) for row in messages.get(chat.id, []) if row["sender_id"] in senders]
+    ))
+  return reads
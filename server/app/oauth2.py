@@ -48,7 +48,7 @@ def get_current_user(token : str = Depends(oauth2_scheme), db : Session = Depend
   
   token_data = verify_token(token,credentials_exception)
   user = db.get(User,token_data.id)
-  if user is None:
+  if user is None or user.deleted_at:
     raise credentials_exception
   return user
 
@@ -74,7 +74,7 @@ async def get_current_user_websocket(websocket: WebSocket, db: Session):
     try:
       token_data = verify_token(token, None)
       user = db.get(User, token_data.id)
-      if user is None:
+      if user is None or user.deleted_at:
         await websocket.close(code=4001, reason="User not found")
         return None
       return user
@@ -0,0 +1,50 @@
+from typing import Iterable, List, Set, Tuple
+from sqlalchemy import delete, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, select, func
+
+from app.model import ChatParticipant, User
+
+
+def resolve_user_ids(db : Session, user_ids : Iterable[int] = (), emails : Iterable[str] = ()) -> Tuple[Set[int], List]:
+  """Maps ids/emails to live user ids in one query. Returns (found ids, unknown ids and emails)."""
+  user_ids, emails = set(user_ids), set(emails)
+  if not user_ids and not emails:
+    return set(), []
+  rows = db.exec(
+    select(User.id, User.email).where(or_(User.id.in_(user_ids), User.email.in_(emails)), User.deleted_at.is_(None))
+  ).all()
+  found_ids = {row[0] for row in rows}
+  found_emails = {row[1] for row in rows}
+  return found_ids, [*sorted(user_ids - found_ids), *sorted(emails - found_emails)]
+
+
+def participant_ids(db : Session, chat_id : int) -> Set[int]:
+  return set(db.exec(select(ChatParticipant.user_id).where(ChatParticipant.chat_id == chat_id)).all())
+
+def participant_count(db : Session, chat_id : int) -> int:
+  return db.exec(select(func.count()).select_from(ChatParticipant).where(ChatParticipant.chat_id == chat_id)).one()
+
+
+def add_participants(db : Session, chat_id : int, user_ids : Iterable[int]) -> List[int]:
+  """INSERT ... ON CONFLICT DO NOTHING; returns only the ids that were actually added.
+  Never loads chat.participants. Runs in the caller's transaction."""
+  values = [{"chat_id": chat_id, "user_id": user_id} for user_id in set(user_ids)]
+  if not values:
+    return []
+  insert = pg_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+  statement = insert(ChatParticipant).values(values).on_conflict_do_nothing().returning(ChatParticipant.user_id)
+  return sorted(db.execute(statement).scalars().all())
+
+def remove_participants(db : Session, chat_id : int, user_ids : Iterable[int]) -> List[int]:
+  """DELETE ... WHERE user_id IN (...); returns only the ids that were actually removed"""
+  user_ids = set(user_ids)
+  if not user_ids:
+    return []
+  statement = (
+    delete(ChatParticipant)
+    .where(ChatParticipant.chat_id == chat_id, ChatParticipant.user_id.in_(user_ids))
+    .returning(ChatParticipant.user_id)
+  )
+  return sorted(db.execute(statement).scalars().all())
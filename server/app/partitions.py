@@ -0,0 +1,353 @@
+from datetime import datetime, date
+from typing import Dict, Iterator, List, Tuple
+from sqlalchemy import text
+from sqlmodel import Session, select, func
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+from app.config import settings
+from app.databases import engine
+from app.model import MessageArchive, MessageArchiveChat
+
+
+# --- Partition naming / DDL (mirrored in the partitioning alembic migration) ---
+
+def month_start(value : date) -> date:
+  return date(value.year, value.month, 1)
+
+def add_months(value : date, months : int) -> date:
+  index = value.year * 12 + value.month - 1 + months
+  return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(start : date) -> str:
+  return f"message_p{start.year:04d}_{start.month:02d}"
+
+def create_partition_sql(start : date) -> str:
+  end = add_months(start, 1)
+  return (
+    f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF message "
+    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+  )
+
+
+def is_partitioned() -> bool:
+  return engine.dialect.name == "postgresql"
+
+
+def ensure_future_partitions(months_ahead : int | None = None):
+  """Creates monthly partitions from the current month up to months_ahead months out"""
+  months_ahead = settings.MESSAGE_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+  current = month_start(datetime.now().date())
+  with engine.begin() as conn:
+    for i in range(months_ahead + 1):
+      conn.execute(text(create_partition_sql(add_months(current, i))))
+
+
+# --- Cold history archival ---
+#
+# Each archived partition is a directory holding one gzipped JSONL file per
+# chat (chat_<id>.jsonl.gz, oldest first) plus orphans.jsonl.gz for rows that
+# had no chat. Reading a chat's history opens only that chat's files.
+# Archives written before this layout are single files ordered by chat and
+# are still read (and purged) through the legacy path.
+
+ORPHANS_FILE = "orphans.jsonl.gz"
+
+
+class ArchiveUnavailable(RuntimeError):
+  """An archive listed in the (shared) manifest is missing from this node's MESSAGE_ARCHIVE_DIR"""
+
+  def __init__(self, path : str):
+    super().__init__(f"Archive {path} is not reachable from this node; MESSAGE_ARCHIVE_DIR must be storage shared by every node")
+
+def archive_path(name : str) -> str:
+  return os.path.join(settings.MESSAGE_ARCHIVE_DIR, name)
+
+def chat_archive_path(path : str, chat_id : int) -> str:
+  return os.path.join(path, f"chat_{chat_id}.jsonl.gz")
+
+def _is_legacy(path : str) -> bool:
+  return path.endswith(".jsonl.gz")
+
+def _archive_files(path : str) -> List[str]:
+  if _is_legacy(path):
+    return [path]
+  if not os.path.isdir(path):
+    raise ArchiveUnavailable(path)
+  # Skips *.tmp files a crashed rewrite left behind
+  return [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith(".jsonl.gz")]
+
+def _open_archive(path : str):
+  try:
+    return gzip.open(path, "rt", encoding="utf-8")
+  except FileNotFoundError:
+    raise ArchiveUnavailable(path) from None
+
+def check_archive_storage():
+  """Startup check that every archive in the manifest is reachable from this node"""
+  if not is_partitioned():
+    return
+  with Session(engine) as session:
+    paths = session.exec(select(MessageArchive.path)).all()
+  missing = [path for path in paths if not os.path.exists(path)]
+  if missing:
+    raise ArchiveUnavailable(f"{missing[0]} (and {len(missing) - 1} more)" if len(missing) > 1 else missing[0])
+
+def _cold_partitions(conn, cutoff : date) -> List[str]:
+  rows = conn.execute(text(
+    "SELECT c.relname FROM pg_inherits i "
+    "JOIN pg_class c ON c.oid = i.inhrelid "
+    "JOIN pg_class p ON p.oid = i.inhparent "
+    "WHERE p.relname = 'message' ORDER BY c.relname"
+  )).all()
+  return [name for (name,) in rows if name < partition_name(cutoff)]
+
+def _dump(record) -> str:
+  record = dict(record)
+  record["created_at"] = record["created_at"].isoformat()
+  return json.dumps(record) + "\n"
+
+def _write_partition(name : str) -> Dict[int, int]:
+  """Dumps a partition to one gzipped JSONL file per chat, returning per-chat row counts"""
+  path = archive_path(name)
+  os.makedirs(settings.MESSAGE_ARCHIVE_DIR, exist_ok=True)
+  # Private to this call, next to the target so the final os.replace stays on one filesystem
+  tmp = tempfile.mkdtemp(prefix=f"{name}.", suffix=".tmp", dir=settings.MESSAGE_ARCHIVE_DIR)
+  os.chmod(tmp, 0o755)
+  try:
+    counts = _dump_partition(name, tmp)
+  except BaseException:
+    shutil.rmtree(tmp, ignore_errors=True)
+    raise
+  shutil.rmtree(path, ignore_errors=True)
+  os.replace(tmp, path)
+  return counts
+
+def _dump_partition(name : str, tmp : str) -> Dict[int, int]:
+  columns = "id, content, created_at, chat_id, violation_status, sender_id"
+  counts : Dict[int, int] = {}
+  with engine.connect() as conn:
+    result = conn.execution_options(stream_results=True, yield_per=5000).execute(text(
+      f"SELECT {columns} FROM {name} WHERE chat_id IS NOT NULL ORDER BY chat_id, created_at, id"
+    ))
+    current, f = None, None
+    try:
+      for row in result.mappings():
+        if row["chat_id"] != current:
+          if f is not None:
+            f.close()
+          current = row["chat_id"]
+          f = gzip.open(chat_archive_path(tmp, current), "wt", encoding="utf-8")
+        f.write(_dump(row))
+        counts[current] = counts.get(current, 0) + 1
+    finally:
+      if f is not None:
+        f.close()
+
+    # Rows without a chat are kept but never paged into history
+    orphans = conn.execution_options(stream_results=True, yield_per=5000).execute(text(
+      f"SELECT {columns} FROM {name} WHERE chat_id IS NULL ORDER BY created_at, id"
+    ))
+    with gzip.open(os.path.join(tmp, ORPHANS_FILE), "wt", encoding="utf-8") as f:
+      for row in orphans.mappings():
+        f.write(_dump(row))
+  return counts
+
+def archive_cold_partitions(older_than_months : int | None = None) -> List[str]:
+  """Moves partitions older than the cutoff to compressed JSONL files and drops them"""
+  older_than_months = settings.MESSAGE_ARCHIVE_AFTER_MONTHS if older_than_months is None else older_than_months
+  cutoff = add_months(month_start(datetime.now().date()), -older_than_months)
+  with engine.connect() as conn:
+    names = _cold_partitions(conn, cutoff)
+
+  archived = []
+  for name in names:
+    counts = _write_partition(name)
+    start = date(int(name[9:13]), int(name[14:16]), 1)
+    with Session(engine) as session:
+      archive = MessageArchive(
+        partition_name=name,
+        range_start=datetime.combine(start, datetime.min.time()),
+        range_end=datetime.combine(add_months(start, 1), datetime.min.time()),
+        path=archive_path(name),
+        row_count=sum(counts.values())
+      )
+      session.add(archive)
+      session.flush()
+      for chat_id, row_count in counts.items():
+        session.add(MessageArchiveChat(archive_id=archive.id, chat_id=chat_id, row_count=row_count))
+      # Manifest and detach commit together; a crash before this point just rewrites the files
+      session.execute(text(f"ALTER TABLE message DETACH PARTITION {name}"))
+      session.execute(text(f"DROP TABLE {name}"))
+      session.commit()
+    archived.append(name)
+    print(f"Archived partition {name} ({sum(counts.values())} rows)")
+  return archived
+
+
+def archived_message_count(db : Session, chat_id : int) -> int:
+  return db.exec(select(func.coalesce(func.sum(MessageArchiveChat.row_count), 0)).where(MessageArchiveChat.chat_id == chat_id)).one()
+
+def _chat_archives(db : Session, chat_id : int):
+  return db.exec(
+    select(MessageArchive, MessageArchiveChat.row_count)
+    .join(MessageArchiveChat, MessageArchiveChat.archive_id == MessageArchive.id)
+    .where(MessageArchiveChat.chat_id == chat_id)
+    .order_by(MessageArchive.range_start)
+  ).all()
+
+def _iter_legacy_chat(path : str, chat_id : int) -> Iterator[str]:
+  with _open_archive(path) as f:
+    for line in f:
+      record_chat_id = json.loads(line)["chat_id"]
+      if record_chat_id is None or record_chat_id < chat_id:
+        continue
+      if record_chat_id > chat_id:
+        break
+      yield line
+
+def iter_archived_messages(db : Session, chat_id : int, skip : int = 0) -> Iterator[dict]:
+  """Yields a chat's archived messages oldest first, skipping the first `skip` rows"""
+  for archive, row_count in _chat_archives(db, chat_id):
+    # Whole files before the requested position are skipped without being opened
+    if skip >= row_count:
+      skip -= row_count
+      continue
+    if _is_legacy(archive.path):
+      lines = _iter_legacy_chat(archive.path, chat_id)
+    else:
+      lines = _open_archive(chat_archive_path(archive.path, chat_id))
+    try:
+      for line in lines:
+        # Skipped rows are never decoded
+        if skip:
+          skip -= 1
+          continue
+        record = json.loads(line)
+        record["created_at"] = datetime.fromisoformat(record["created_at"])
+        yield record
+    finally:
+      lines.close()
+
+def iter_archived_messages_by_sender(db : Session, sender_id : int) -> Iterator[dict]:
+  """Yields every archived message sent by a user, oldest archive first"""
+  archives = db.exec(select(MessageArchive).order_by(MessageArchive.range_start)).all()
+  for archive in archives:
+    for path in _archive_files(archive.path):
+      with _open_archive(path) as f:
+        for line in f:
+          record = json.loads(line)
+          if record["sender_id"] == sender_id:
+            record["created_at"] = datetime.fromisoformat(record["created_at"])
+            yield record
+
+
+# --- Purging archived history ---
+
+def _rollup_key(record : dict) -> Tuple[datetime, int | None, str]:
+  return datetime.fromisoformat(record["created_at"]), record["chat_id"], record["violation_status"]
+
+def _rewrite_without(path : str, drop, deleted : List | None = None) -> Dict[int | None, int]:
+  """Rewrites an archive file without the records `drop` matches; returns removed rows per chat.
+  Removed rows are also appended to `deleted` as (created_at, chat_id, violation_status)."""
+  removed : Dict[int | None, int] = {}
+  fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+  os.close(fd)
+  os.chmod(tmp, 0o644)
+  with _open_archive(path) as src, gzip.open(tmp, "wt", encoding="utf-8") as dst:
+    for line in src:
+      record = json.loads(line)
+      if drop(record):
+        removed[record["chat_id"]] = removed.get(record["chat_id"], 0) + 1
+        if deleted is not None:
+          deleted.append(_rollup_key(record))
+      else:
+        dst.write(line)
+  if removed:
+    os.replace(tmp, path)
+  else:
+    os.remove(tmp)
+  return removed
+
+def _apply_removed(session : Session, archive : MessageArchive, removed : Dict[int | None, int]):
+  for chat_id, count in removed.items():
+    archive.row_count -= count
+    entry = session.get(MessageArchiveChat, (archive.id, chat_id)) if chat_id is not None else None
+    if entry is not None:
+      entry.row_count -= count
+      if entry.row_count <= 0:
+        session.delete(entry)
+      else:
+        session.add(entry)
+  session.add(archive)
+
+def purge_archived_chat(session : Session, chat_id : int, deleted : List | None = None) -> Dict[int | None, int]:
+  """Removes a chat's archived messages and manifest entries; returns removed rows per chat. Caller commits.
+  Removed rows are also appended to `deleted` as (created_at, chat_id, violation_status)."""
+  removed : Dict[int | None, int] = {}
+  for archive, row_count in _chat_archives(session, chat_id):
+    if _is_legacy(archive.path):
+      counts = _rewrite_without(archive.path, lambda record: record["chat_id"] == chat_id, deleted)
+    else:
+      path = chat_archive_path(archive.path, chat_id)
+      if os.path.exists(path):
+        if deleted is not None:
+          with _open_archive(path) as f:
+            deleted.extend(_rollup_key(json.loads(line)) for line in f)
+        os.remove(path)
+      counts = {chat_id: row_count}
+    _apply_removed(session, archive, counts)
+    for key, count in counts.items():
+      removed[key] = removed.get(key, 0) + count
+  return removed
+
+def purge_archived_sender(session : Session, sender_id : int, after_archive_id : int | None = None, deleted : List | None = None) -> Tuple[Dict[int | None, int], int | None]:
+  """Removes a user's messages from the next archive after `after_archive_id`, one bounded step per call.
+  Returns removed rows per chat and that archive's id, or None once no archive is left. Caller commits."""
+  archive = session.exec(
+    select(MessageArchive).where(MessageArchive.id > (after_archive_id or 0)).order_by(MessageArchive.id).limit(1)
+  ).first()
+  if archive is None:
+    return {}, None
+  removed : Dict[int | None, int] = {}
+  for path in _archive_files(archive.path):
+    counts = _rewrite_without(path, lambda record: record["sender_id"] == sender_id, deleted)
+    if counts:
+      _apply_removed(session, archive, counts)
+      for key, count in counts.items():
+        removed[key] = removed.get(key, 0) + count
+  return removed, archive.id
+
+
+# Advisory lock key shared by every worker process on every node
+MAINTENANCE_LOCK_KEY = 0x6D736770
+
+class PartitionMaintainer:
+  """Keeps future message partitions created and archives cold ones"""
+
+  def run_once(self) -> bool:
+    """One maintenance pass, unless another process is running one. Returns False when skipped."""
+    with engine.begin() as conn:
+      # Transaction-scoped, so it is released with the connection however the pass ends
+      if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY}).scalar():
+        return False
+      ensure_future_partitions()
+      archive_cold_partitions()
+    return True
+
+  async def run(self):
+    if not is_partitioned():
+      return
+    while True:
+      try:
+        await asyncio.to_thread(self.run_once)
+      except Exception as e:
+        print(f"Partition maintenance error: {e}")
+      await asyncio.sleep(settings.PARTITION_MAINTENANCE_INTERVAL)
+
+
+partition_maintainer = PartitionMaintainer()
@@ -0,0 +1,160 @@
+from datetime import datetime, timezone
+from typing import List, Set, Tuple
+from sqlalchemy import delete
+from sqlmodel import Session, select
+import asyncio
+
+from app.config import settings
+from app.databases import engine
+from app.model import Chat, ChatParticipant, Message, PurgeJob, User
+from app import sharding
+from app.partitions import purge_archived_chat, purge_archived_sender
+from app.versioning import bump_chat_versions
+from app.analytics import subtract_purged
+
+
+def schedule_chat_purge(db : Session, chat : Chat):
+  """Logically deletes a chat and queues its rows for background removal. Caller commits."""
+  chat.deleted_at = datetime.now(timezone.utc)
+  db.add(chat)
+  db.add(PurgeJob(kind="chat", target_id=chat.id))
+
+
+def schedule_user_purge(db : Session, user : User):
+  """Logically deletes a user and queues their rows for background removal. Caller commits."""
+  user.deleted_at = datetime.now(timezone.utc)
+  db.add(user)
+  db.add(PurgeJob(kind="user", target_id=user.id))
+
+
+class PurgeWorker:
+  """Removes purged chats/users in bounded chunks, one short transaction per chunk.
+
+  All progress lives in the purge_job table, so a restarted worker simply picks
+  up the oldest unfinished job where it left off.
+  """
+
+  def __init__(self, chunk_size : int | None = None, throttle : float | None = None):
+    self.chunk_size = chunk_size or settings.PURGE_CHUNK_SIZE
+    self.throttle = settings.PURGE_THROTTLE_SECONDS if throttle is None else throttle
+
+  def _delete_chunk(self, session : Session, model, key, column, value, chat_column) -> Tuple[int, Set[int]]:
+    """Deletes up to chunk_size rows of model where column == value, selected by key.
+    Returns the row count and the chats those rows belonged to."""
+    rows = session.exec(select(key, chat_column).where(column == value).limit(self.chunk_size)).all()
+    if not rows:
+      return 0, set()
+    session.execute(delete(model).where(column == value, key.in_([row[0] for row in rows])))
+    return len(rows), {row[1] for row in rows}
+
+  def _delete_message_chunk(self, session : Session, column, value) -> List[Tuple[datetime, int | None, str]]:
+    """Deletes up to chunk_size messages where column == value.
+    Returns them as (created_at, chat_id, violation_status), what the rollups need."""
+    rows = session.exec(
+      select(Message.id, Message.created_at, Message.chat_id, Message.violation_status).where(column == value).limit(self.chunk_size)
+    ).all()
+    if rows:
+      session.execute(delete(Message).where(column == value, Message.id.in_([row[0] for row in rows])))
+    return [tuple(row[1:]) for row in rows]
+
+  def _delete_shard_chunk(self, shards, column, value) -> List[Tuple[datetime, int | None, str]]:
+    """Deletes one chunk of messages from the first listed shard that still has any"""
+    for shard in shards:
+      with Session(sharding.shard_engines[shard]) as shard_session:
+        deleted = self._delete_message_chunk(shard_session, column, value)
+        shard_session.commit()
+      if deleted:
+        return deleted
+    return []
+
+  def _purge_step(self, session : Session, job : PurgeJob) -> bool:
+    """Deletes one chunk for the job. Returns True once nothing is left."""
+    if job.kind == "chat":
+      message_column, target = Message.chat_id, Chat
+      participant_key, participant_column = ChatParticipant.user_id, ChatParticipant.chat_id
+    else:
+      message_column, target = Message.sender_id, User
+      participant_key, participant_column = ChatParticipant.chat_id, ChatParticipant.user_id
+
+    # Every chat that loses rows gets a new version, so cached (304) reads are refreshed,
+    # and the rollups lose the rows just as they do for a single deleted message
+    deleted = self._delete_message_chunk(session, message_column, job.target_id)
+    if not deleted and sharding.enabled():
+      if job.kind == "chat":
+        chat = session.get(Chat, job.target_id)
+        shards = [chat.shard] if chat is not None and chat.shard is not None else []
+      else:
+        shards = range(len(sharding.shard_engines))
+      deleted = self._delete_shard_chunk(shards, message_column, job.target_id)
+    if deleted:
+      job.messages_deleted += len(deleted)
+      bump_chat_versions(session, (chat_id for _, chat_id, _ in deleted))
+      subtract_purged(session, deleted)
+      return False
+
+    deleted, chat_ids = self._delete_chunk(session, ChatParticipant, participant_key, participant_column, job.target_id, ChatParticipant.chat_id)
+    if deleted:
+      job.participants_deleted += deleted
+      bump_chat_versions(session, chat_ids)
+      return False
+
+    # Archived history goes last: a chat's files at once, a user's one archive per step
+    archived : List[Tuple[datetime, int | None, str]] = []
+    if job.kind == "chat":
+      removed = purge_archived_chat(session, job.target_id, archived)
+    else:
+      removed, archive_id = purge_archived_sender(session, job.target_id, job.archive_cursor, archived)
+    job.messages_deleted += sum(removed.values())
+    bump_chat_versions(session, removed)
+    subtract_purged(session, archived)
+    if job.kind == "user" and archive_id is not None:
+      job.archive_cursor = archive_id
+      return False
+
+    session.execute(delete(target).where(target.id == job.target_id))
+    return True
+
+  def run_once(self) -> bool:
+    """Processes one chunk of the oldest unfinished job. Returns False when idle."""
+    with Session(engine) as session:
+      job = session.exec(
+        select(PurgeJob)
+        .where(PurgeJob.status.in_(("pending", "running")))
+        .order_by(PurgeJob.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+      ).first()
+      if not job:
+        return False
+
+      now = datetime.now(timezone.utc)
+      try:
+        job.status = "running"
+        if self._purge_step(session, job):
+          job.status = "done"
+          job.finished_at = now
+        job.updated_at = now
+        session.add(job)
+        session.commit()
+      except Exception as e:
+        session.rollback()
+        job = session.get(PurgeJob, job.id)
+        job.status = "failed"
+        job.error = str(e)
+        job.updated_at = now
+        session.add(job)
+        session.commit()
+        print(f"Purge job {job.id} failed: {e}")
+      return True
+
+  async def run(self):
+    while True:
+      try:
+        did_work = await asyncio.to_thread(self.run_once)
+      except Exception as e:
+        print(f"Purge worker error: {e}")
+        did_work = False
+      await asyncio.sleep(self.throttle if did_work else settings.PURGE_POLL_INTERVAL)
+
+
+purge_worker = PurgeWorker()
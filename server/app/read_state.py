@@ -0,0 +1,98 @@
+from typing import Dict, List, Set, Tuple
+from sqlalchemy import or_, update
+from sqlmodel import Session, select
+import asyncio
+
+from app.config import settings
+from app.databases import engine
+from app.model import Chat, ChatParticipant, Message
+from app.sharding import engine_for
+from app.websockets import manager
+
+
+class ReadMarkBuffer:
+  """Coalesces "mark read" requests and writes them to chat_participant in batches"""
+
+  def __init__(self):
+    # (chat_id, user_id) -> highest message id reported since the last flush
+    self.pending : Dict[Tuple[int, int], int] = {}
+    self._flusher : asyncio.Task | None = None
+
+  def mark(self, chat_id : int, user_id : int, message_id : int):
+    key = (chat_id, user_id)
+    if message_id > self.pending.get(key, 0):
+      self.pending[key] = message_id
+    self._ensure_flusher()
+
+  def _existing(self, session : Session, marks : Dict[Tuple[int, int], int]) -> Dict[Tuple[int, int], int]:
+    """Drops marks whose message is not in that chat, checking wherever the chat's messages live"""
+    shards = dict(session.exec(select(Chat.id, Chat.shard).where(Chat.id.in_({chat_id for chat_id, _ in marks}))).all())
+    wanted : Dict[int | None, Set[int]] = {}
+    for (chat_id, _), message_id in marks.items():
+      wanted.setdefault(shards.get(chat_id), set()).add(message_id)
+    found = set()
+    for shard, message_ids in wanted.items():
+      statement = select(Message.id, Message.chat_id).where(Message.id.in_(message_ids))
+      if shard is None:
+        found.update(tuple(row) for row in session.exec(statement).all())
+      else:
+        with Session(engine_for(shard)) as shard_session:
+          found.update(tuple(row) for row in shard_session.exec(statement).all())
+    return {key: message_id for key, message_id in marks.items() if (message_id, key[0]) in found}
+
+  def _write(self, marks : Dict[Tuple[int, int], int]) -> List[Tuple[int, int, int]]:
+    """Applies marks in one transaction; returns (chat_id, user_id, message_id) for the marks that advanced"""
+    table = ChatParticipant.__table__
+    advanced = []
+    with Session(engine) as session:
+      for (chat_id, user_id), message_id in self._existing(session, marks).items():
+        statement = (
+          update(table)
+          .where(
+            table.c.chat_id == chat_id,
+            table.c.user_id == user_id,
+            # Never move a high-water mark backwards
+            or_(table.c.last_read_message_id.is_(None), table.c.last_read_message_id < message_id),
+          )
+          .values(last_read_message_id=message_id)
+          .returning(table.c.chat_id, table.c.user_id, table.c.last_read_message_id)
+        )
+        advanced.extend(tuple(row) for row in session.execute(statement).all())
+      session.commit()
+    return advanced
+
+  async def flush(self):
+    """Writes all pending marks in one transaction and broadcasts one receipt frame per chat"""
+    if not self.pending:
+      return
+    marks, self.pending = self.pending, {}
+    try:
+      advanced = await asyncio.to_thread(self._write, marks)
+    except Exception:
+      # Put the marks back (keeping the higher of old and newer ones) for the next flush
+      for key, message_id in marks.items():
+        if message_id > self.pending.get(key, 0):
+          self.pending[key] = message_id
+      raise
+
+    # Only marks that actually moved are announced
+    receipts : Dict[int, list] = {}
+    for chat_id, user_id, message_id in advanced:
+      receipts.setdefault(chat_id, []).append({"user_id": user_id, "last_read_message_id": message_id})
+    for chat_id, reads in receipts.items():
+      await manager.broadcast({"type": "read_receipts", "chat_id": chat_id, "reads": reads}, chat_id)
+
+  def _ensure_flusher(self):
+    if self._flusher is None or self._flusher.done():
+      self._flusher = asyncio.create_task(self._flush_loop())
+
+  async def _flush_loop(self):
+    while True:
+      await asyncio.sleep(settings.READ_MARK_FLUSH_INTERVAL)
+      try:
+        await self.flush()
+      except Exception as e:
+        print(f"Error flushing read marks: {e}")
+
+
+read_marks = ReadMarkBuffer()
@@ -0,0 +1,81 @@
+from fastapi import Request, Response
+from sqlalchemy import text
+from sqlmodel import Session
+import math
+import time
+
+from app.config import settings
+from app.databases import engine, read_engine
+from app.oauth2 import verify_token
+
+
+# Read-your-writes pin carried by the client (cookie for browsers, echoed header
+# for API clients), so it holds whichever worker or node serves the next read
+PIN_COOKIE = "primary_until"
+PIN_HEADER = "X-Primary-Until"
+
+_lag_state = {"checked_at": 0.0, "healthy": False}
+
+REPLICA_LAG_SQL = text(
+  "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+  "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+def request_user_id(request : Request) -> int | None:
+  """User id from the bearer token without touching the database"""
+  authorization = request.headers.get("authorization", "")
+  scheme, _, token = authorization.partition(" ")
+  if scheme.lower() != "bearer" or not token:
+    return None
+  try:
+    return verify_token(token, None).id
+  except Exception:
+    return None
+
+
+def pin_to_primary(response : Response):
+  """Read-your-writes: tells the client to keep its reads on the primary for a short window"""
+  until = f"{time.time() + settings.REPLICA_PIN_SECONDS:.3f}"
+  response.set_cookie(PIN_COOKIE, until, max_age=math.ceil(settings.REPLICA_PIN_SECONDS), httponly=True, samesite="lax")
+  response.headers[PIN_HEADER] = until
+
+def is_pinned(request : Request) -> bool:
+  value = request.headers.get(PIN_HEADER) or request.cookies.get(PIN_COOKIE)
+  if not value:
+    return False
+  try:
+    until = float(value)
+  except ValueError:
+    return False
+  now = time.time()
+  # Bounded (with a second of slack for clock skew between nodes), so a forged
+  # deadline can't keep a client off the replica for long
+  return now < until <= now + settings.REPLICA_PIN_SECONDS + 1
+
+
+def replica_healthy() -> bool:
+  """Replication lag check, cached for REPLICA_LAG_CHECK_INTERVAL seconds"""
+  if read_engine is None:
+    return False
+  now = time.monotonic()
+  if now - _lag_state["checked_at"] < settings.REPLICA_LAG_CHECK_INTERVAL:
+    return _lag_state["healthy"]
+  _lag_state["checked_at"] = now
+  try:
+    lag = 0.0
+    if read_engine.dialect.name == "postgresql":
+      with read_engine.connect() as conn:
+        lag = float(conn.execute(REPLICA_LAG_SQL).scalar() or 0)
+    _lag_state["healthy"] = lag <= settings.REPLICA_MAX_LAG_SECONDS
+  except Exception as e:
+    print(f"Replica lag check failed: {e}")
+    _lag_state["healthy"] = False
+  return _lag_state["healthy"]
+
+
+def get_read_session(request : Request):
+  """Session for read-only endpoints: the replica when configured, healthy and not pinned"""
+  use_replica = read_engine is not None and not is_pinned(request) and replica_healthy()
+  with Session(read_engine if use_replica else engine) as session:
+    yield session
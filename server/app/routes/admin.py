@@ -0,0 +1,139 @@
+from fastapi import APIRouter,Depends,status,Query,HTTPException,UploadFile
+from fastapi.responses import StreamingResponse
+from app.databases import get_session
+from app.replica import get_read_session
+from sqlmodel import Session,select,func
+from typing import Annotated,List,Literal
+from app.model import User,Chat,PurgeJob,MessageDailyRollup,ChatDailyRollup
+from app.schemas import PurgeJobRead,BulkImportReport,DailyViolationStats,ChatActivity,UserReadWithAdminInfo
+from app.oauth2 import get_admin_user
+from app.export import MEDIA_TYPES,export_stream,iter_message_rows
+from app.bulk_import import import_users,read_rows
+from app.drain import drain_node
+from app.config import settings
+from datetime import date,timedelta
+import asyncio
+import io
+router = APIRouter(prefix="/admin",tags=["admin"])
+
+
+@router.get('/purge-jobs',status_code=status.HTTP_200_OK,response_model=List[PurgeJobRead])
+async def get_purge_jobs(
+    db: Session = Depends(get_read_session),
+    status_filter: Annotated[str | None, Query(alias="status")] = None,
+    offset: int = 0,
+    limit: Annotated[int, Query(le=100)] = 100,
+    current_user: User = Depends(get_admin_user)
+):
+    """List background purge jobs and their progress, newest first"""
+    statement = select(PurgeJob)
+    if status_filter:
+        statement = statement.where(PurgeJob.status == status_filter)
+    statement = statement.order_by(PurgeJob.id.desc()).offset(offset).limit(limit)
+    return db.exec(statement).all()
+
+
+def _export_response(rows, filename : str, fmt : str, compress : bool) -> StreamingResponse:
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.{fmt}{".gz" if compress else ""}"'}
+    media_type = "application/gzip" if compress else MEDIA_TYPES[fmt]
+    return StreamingResponse(export_stream(rows, fmt, compress), media_type=media_type, headers=headers)
+
+@router.get('/export/chats/{id}',status_code=status.HTTP_200_OK)
+async def export_chat_messages(
+    id: int,
+    db: Session = Depends(get_session),
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+    current_user: User = Depends(get_admin_user)
+):
+    """Stream a chat's full message history (archived and live) for compliance export"""
+    if not db.get(Chat, id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found")
+    return _export_response(iter_message_rows(chat_id=id), f"chat-{id}-messages", format, gzip)
+
+@router.get('/export/users/{id}',status_code=status.HTTP_200_OK)
+async def export_user_messages(
+    id: int,
+    db: Session = Depends(get_session),
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+    current_user: User = Depends(get_admin_user)
+):
+    """Stream every message a user has sent for compliance export"""
+    if not db.get(User, id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return _export_response(iter_message_rows(sender_id=id), f"user-{id}-messages", format, gzip)
+
+
+@router.post('/users/import',status_code=status.HTTP_200_OK,response_model=BulkImportReport)
+async def import_users_as_admin(
+    file: UploadFile,
+    format: Literal["csv", "jsonl"] = "csv",
+    current_user: User = Depends(get_admin_user)
+):
+    """Bulk-create users from a CSV (name,email,password) or JSONL upload.
+    Uploads over BULK_IMPORT_MAX_HTTP_ROWS rows are refused; use import_users.py for those."""
+    stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+    rows = await asyncio.to_thread(lambda: sum(1 for _ in read_rows(stream, format)))
+    if rows > settings.BULK_IMPORT_MAX_HTTP_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"{rows} rows exceeds the limit of {settings.BULK_IMPORT_MAX_HTTP_ROWS}; run import_users.py instead"
+        )
+    stream.seek(0)
+    return await asyncio.to_thread(import_users, read_rows(stream, format))
+
+
+#--- ANALYTICS (reads rollup tables only) ---
+
+@router.get('/analytics/violations',status_code=status.HTTP_200_OK,response_model=List[DailyViolationStats])
+async def get_violation_trends(
+    db: Session = Depends(get_read_session),
+    days: Annotated[int, Query(ge=1, le=366)] = 30,
+    current_user: User = Depends(get_admin_user)
+):
+    """Messages per day by moderation outcome over the last `days` days"""
+    since = date.today() - timedelta(days=days - 1)
+    statement = select(MessageDailyRollup).where(MessageDailyRollup.day >= since).order_by(MessageDailyRollup.day)
+    return db.exec(statement).all()
+
+@router.get('/analytics/offenders',status_code=status.HTTP_200_OK,response_model=List[UserReadWithAdminInfo])
+async def get_top_offenders(
+    db: Session = Depends(get_read_session),
+    limit: Annotated[int, Query(le=100)] = 10,
+    current_user: User = Depends(get_admin_user)
+):
+    """Users with the most violations (served from the violation_count index)"""
+    statement = (
+        select(User)
+        .where(User.violation_count > 0, User.deleted_at.is_(None))
+        .order_by(User.violation_count.desc())
+        .limit(limit)
+    )
+    return db.exec(statement).all()
+
+@router.get('/analytics/busiest-chats',status_code=status.HTTP_200_OK,response_model=List[ChatActivity])
+async def get_busiest_chats(
+    db: Session = Depends(get_read_session),
+    days: Annotated[int, Query(ge=1, le=366)] = 7,
+    limit: Annotated[int, Query(le=100)] = 10,
+    current_user: User = Depends(get_admin_user)
+):
+    """Chats with the most messages over the last `days` days"""
+    since = date.today() - timedelta(days=days - 1)
+    total = func.sum(ChatDailyRollup.message_count)
+    statement = (
+        select(ChatDailyRollup.chat_id, total)
+        .where(ChatDailyRollup.day >= since)
+        .group_by(ChatDailyRollup.chat_id)
+        .order_by(total.desc())
+        .limit(limit)
+    )
+    return [{"chat_id": chat_id, "message_count": count} for chat_id, count in db.exec(statement).all()]
+
+
+@router.post('/drain',status_code=status.HTTP_200_OK)
+async def drain(current_user: User = Depends(get_admin_user)):
+    """Take this node out of rotation before a restart: readiness turns 503,
+    sockets are asked to reconnect elsewhere with jitter, buffers are flushed"""
+    return await drain_node()
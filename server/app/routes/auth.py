@@ -10,7 +10,7 @@ router = APIRouter(prefix="/auth",tags=["auth"])
 
 @router.post("/login",status_code=status.HTTP_200_OK,response_model=Token)
 async def login(form_data : OAuth2PasswordRequestForm = Depends(), db : Session = Depends(get_session)):
-  statement = (select(User).where(User.email == form_data.username))
+  statement = (select(User).where(User.email == form_data.username, User.deleted_at.is_(None)))
   user = db.exec(statement).first()
   
   if not user:
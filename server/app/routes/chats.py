@@ -1,19 +1,29 @@
-from fastapi import APIRouter,Depends,status,Query,HTTPException,Response,Body
+from fastapi import APIRouter,Depends,status,Query,HTTPException,Response,Body,Request
 from app.oauth2 import get_current_user
 from app.databases import get_session
-from sqlmodel import Session,select
-from typing import Annotated,List
-from app.model import User,Chat
-from app.schemas import ChatCreate,ChatRead,ChatUpdate,AddParticipantRequest
+from app.replica import get_read_session
+from sqlmodel import Session,select,func,and_
+from typing import Annotated,List,Union
+from app.model import User,Chat,ChatParticipant,Message
+from app.schemas import UserRead,ChatCreate,ChatRead,ChatReadNormalized,BulkParticipantsRequest,ParticipantDelta,ChatReadWithUnread,ChatUpdate,AddParticipantRequest,MarkReadRequest
+from app.read_state import read_marks
+from app.purge import schedule_chat_purge
+from app.versioning import bump_chat_version,check_not_modified
+from app.websockets import manager
+from app.instrumentation import query_budget
+from app.events import chat_event,publish,publish_participant_added,publish_participant_removed,publish_participants_changed,publish_chat_deleted
+from app.participants import resolve_user_ids,participant_ids,participant_count,add_participants,remove_participants
+from app.normalized import chat_reads,normalized_chat
+from app import sharding
 
 
 router = APIRouter(prefix="/chats",tags = ["chats"])
 
 
 
-@router.get('/',status_code=status.HTTP_200_OK,response_model=List[ChatRead])
+@router.get('/',status_code=status.HTTP_200_OK,response_model=List[ChatReadWithUnread])
 async def get_chats(
-    db: Session = Depends(get_session),
+    db: Session = Depends(get_read_session),
     offset: int = 0,
     limit: Annotated[int, Query(le=100)] = 100,
     current_user: User = Depends(get_current_user)
@@ -22,12 +32,40 @@ async def get_chats(
     statement = (
         select(Chat)
         .join(Chat.participants)
-        .where(User.id == current_user.id)
+        .where(User.id == current_user.id, Chat.deleted_at.is_(None))
         .offset(offset)
         .limit(limit)
     )
     results = db.exec(statement).all()
-    return results
+    
+    # Unread counts for the whole page in one grouped query over the (chat_id, id) index
+    unread_counts = {}
+    if results:
+        unread_statement = (
+            select(ChatParticipant.chat_id, func.count(Message.id))
+            .join(Message, and_(
+                Message.chat_id == ChatParticipant.chat_id,
+                Message.id > func.coalesce(ChatParticipant.last_read_message_id, 0),
+                Message.sender_id != current_user.id
+            ))
+            .where(
+                ChatParticipant.user_id == current_user.id,
+                ChatParticipant.chat_id.in_([chat.id for chat in results])
+            )
+            .group_by(ChatParticipant.chat_id)
+        )
+        unread_counts = dict(db.exec(unread_statement).all())
+        if sharding.enabled():
+            last_read = dict(db.exec(
+                select(ChatParticipant.chat_id, ChatParticipant.last_read_message_id)
+                .where(ChatParticipant.user_id == current_user.id, ChatParticipant.chat_id.in_([chat.id for chat in results]))
+            ).all())
+            unread_counts.update(sharding.unread_counts(db, current_user.id, last_read))
+    
+    return [
+        read.model_copy(update={"unread_count": unread_counts.get(read.id, 0)})
+        for read in chat_reads(db, results, ChatReadWithUnread)
+    ]
   
 @router.post('/',status_code=status.HTTP_201_CREATED,response_model=ChatRead)
 async def create_chat(
@@ -41,7 +79,7 @@ async def create_chat(
     participant_ids.add(current_user.id)  # Always include current user
     
     # Check if all participant IDs exist
-    participants = db.exec(select(User).where(User.id.in_(participant_ids))).all()
+    participants = db.exec(select(User).where(User.id.in_(participant_ids), User.deleted_at.is_(None))).all()
     
     if len(participants) != len(participant_ids):
         found_ids = {p.id for p in participants}
@@ -58,33 +96,53 @@ async def create_chat(
     )
     
     db.add(new_chat)
+    db.flush()
+    # Messages of new chats are spread across shards when sharding is configured
+    new_chat.shard = sharding.place_chat(new_chat.id)
     db.commit()
     db.refresh(new_chat)
     
+    # Let every member's open sockets know about the new chat without polling
+    for participant in participants:
+        await manager.send_to_user(participant.id, {
+            "type": "chat_created",
+            "chat": {"id": new_chat.id, "title": new_chat.title}
+        })
+    
     return new_chat
 
-@router.get('/{id}',status_code=status.HTTP_200_OK,response_model=ChatRead)
+@router.get('/{id}',status_code=status.HTTP_200_OK,response_model=Union[ChatReadNormalized,ChatRead])
 async def get_chat(
     id: int, 
+    request: Request,
+    response: Response,
+    normalized: bool = False,
     db: Session = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
-    """Get a specific chat by ID"""
+    """Get a specific chat by ID. With normalized=true users are listed once in `users`
+    and referenced by id from participants and messages."""
+    not_modified = check_not_modified(request, response, db, id, current_user.id, "normalized" if normalized else "")
+    if not_modified:
+        return not_modified
+    
     chat = db.get(Chat, id)
-    if not chat:
+    if not chat or chat.deleted_at:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail="Chat not found"
         )
     
     # Check if current user is a participant
-    if current_user not in chat.participants:
+    if not db.get(ChatParticipant, (current_user.id, id)):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, 
             detail="You are not a participant in this chat"
         )
     
-    return chat
+    if normalized:
+        return normalized_chat(db, chat)
+    return chat_reads(db, [chat])[0]
 
 @router.put('/{id}',status_code=status.HTTP_200_OK,response_model=ChatRead)
 async def update_chat(
@@ -95,13 +153,13 @@ async def update_chat(
 ):
     """Update chat details (title, etc.)"""
     chat = db.get(Chat, id)
-    if not chat:
+    if not chat or chat.deleted_at:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail="Chat not found"
         )
     
-    if current_user not in chat.participants:
+    if not db.get(ChatParticipant, (current_user.id, id)):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, 
             detail="You are not allowed to update this chat" 
@@ -110,29 +168,110 @@ async def update_chat(
     # Update only the fields that were provided
     update_data = chat_data.model_dump(exclude_unset=True)
     
-    # Handle participant_ids separately if provided
+    old_title = chat.title
+    added, removed = [], []
+    
+    # Handle participant_ids separately if provided: diff by id, never load the collection
     if 'participant_ids' in update_data:
-        participant_ids = set(update_data.pop('participant_ids'))
-        participant_ids.add(current_user.id)  # Always include current user
+        wanted_ids = set(update_data.pop('participant_ids'))
+        wanted_ids.add(current_user.id)  # Always include current user
         
-        participants = db.exec(select(User).where(User.id.in_(participant_ids))).all()
-        if len(participants) != len(participant_ids):
-            found_ids = {p.id for p in participants}
-            missing_ids = participant_ids - found_ids
+        found_ids, missing_ids = resolve_user_ids(db, user_ids=wanted_ids)
+        if missing_ids:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Users with IDs {list(missing_ids)} not found"
+                detail=f"Users with IDs {missing_ids} not found"
             )
-        chat.participants = participants
+        current_ids = participant_ids(db, id)
+        added = add_participants(db, id, wanted_ids - current_ids)
+        removed = remove_participants(db, id, current_ids - wanted_ids)
     
     # Update other fields
     for field, value in update_data.items():
         setattr(chat, field, value)
     
+    chat_version = bump_chat_version(db, chat.id)
     db.commit()
     db.refresh(chat)
     
-    return chat
+    if chat.title != old_title:
+        await publish(chat_event("chat_renamed", chat.id, chat_version, title=chat.title))
+    if added or removed:
+        added_users = db.exec(select(User).where(User.id.in_(added))).all() if added else []
+        await publish_participants_changed(chat.id, chat_version, added_users, removed)
+    
+    return chat_reads(db, [chat])[0]
+
+@router.post('/{id}/participants',status_code=status.HTTP_200_OK,response_model=ParticipantDelta)
+async def add_participants_to_chat(
+    id: int,
+    request: BulkParticipantsRequest,
+    db: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Add many participants by id and/or email. Users already in the chat are skipped."""
+    chat = db.get(Chat, id)
+    if not chat or chat.deleted_at:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, 
+            detail="Chat not found"
+        )
+    
+    if not db.get(ChatParticipant, (current_user.id, id)):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, 
+            detail="You are not allowed to add participants to this chat"
+        )
+    
+    found_ids, not_found = resolve_user_ids(db, request.user_ids, request.user_emails)
+    added = add_participants(db, id, found_ids)
+    if not added:
+        return ParticipantDelta(chat_id=id, chat_version=chat.version, not_found=not_found)
+    
+    chat_version = bump_chat_version(db, id)
+    db.commit()
+    
+    added_users = db.exec(select(User).where(User.id.in_(added))).all()
+    await publish_participants_changed(id, chat_version, added_users, [])
+    return ParticipantDelta(chat_id=id, chat_version=chat_version, added=[UserRead.model_validate(u) for u in added_users], not_found=not_found)
+
+@router.post('/{id}/participants/remove',status_code=status.HTTP_200_OK,response_model=ParticipantDelta)
+async def remove_participants_from_chat(
+    id: int,
+    request: BulkParticipantsRequest,
+    db: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Remove many participants by id and/or email. Users not in the chat are skipped."""
+    chat = db.get(Chat, id)
+    if not chat or chat.deleted_at:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, 
+            detail="Chat not found"
+        )
+    
+    if not db.get(ChatParticipant, (current_user.id, id)):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, 
+            detail="You are not allowed to remove participants from this chat"
+        )
+    
+    found_ids, not_found = resolve_user_ids(db, request.user_ids, request.user_emails)
+    removed = remove_participants(db, id, found_ids)
+    if not removed:
+        return ParticipantDelta(chat_id=id, chat_version=chat.version, not_found=not_found)
+    
+    chat_version = bump_chat_version(db, id)
+    # Same rule as single removal: a chat with one or no participants left is deleted
+    chat_deleted = participant_count(db, id) <= 1
+    if chat_deleted:
+        schedule_chat_purge(db, chat)
+    db.commit()
+    
+    await publish_participants_changed(id, chat_version, [], removed)
+    if chat_deleted:
+        await publish_chat_deleted(id, chat_version)
+    return ParticipantDelta(chat_id=id, chat_version=chat_version, removed=removed, not_found=not_found, chat_deleted=chat_deleted)
 
 @router.patch('/{id}/add',status_code=status.HTTP_200_OK,response_model=ChatRead)
 async def add_participant_to_chat(
@@ -143,7 +282,7 @@ async def add_participant_to_chat(
 ):
     """Add a participant to an existing chat"""
     chat = db.get(Chat, id)
-    if not chat:
+    if not chat or chat.deleted_at:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail="Chat not found"
@@ -169,9 +308,12 @@ async def add_participant_to_chat(
         )
     
     chat.participants.append(user_to_add)
+    chat_version = bump_chat_version(db, chat.id)
     db.commit()
     db.refresh(chat)
-    return chat
+    
+    await publish_participant_added(chat.id, chat_version, user_to_add)
+    return chat_reads(db, [chat])[0]
 
 @router.patch('/{id}/remove',status_code=status.HTTP_200_OK,response_model=ChatRead)
 async def remove_participant_from_chat(
@@ -182,7 +324,7 @@ async def remove_participant_from_chat(
 ):
     """Remove a participant from an existing chat"""
     chat = db.get(Chat, id)
-    if not chat:
+    if not chat or chat.deleted_at:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail="Chat not found"
@@ -208,16 +350,19 @@ async def remove_participant_from_chat(
         )
     
     chat.participants.remove(user_to_remove)
+    chat_version = bump_chat_version(db, chat.id)
     db.commit()
     db.refresh(chat)
+    await publish_participant_removed(chat.id, chat_version, user_to_remove.id)
     
     # If only one or no participants left, delete the chat
     if len(chat.participants) <= 1:
-        db.delete(chat)
+        schedule_chat_purge(db, chat)
         db.commit()
+        await publish_chat_deleted(id, chat_version)
         return Response(status_code=status.HTTP_204_NO_CONTENT)
 
-    return chat
+    return chat_reads(db, [chat])[0]
 
 @router.patch('/{id}/leave',status_code=status.HTTP_200_OK)
 async def leave_chat(
@@ -227,7 +372,7 @@ async def leave_chat(
 ):
     """Leave a chat (remove yourself as a participant)"""
     chat = db.get(Chat, id)
-    if not chat:
+    if not chat or chat.deleted_at:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail="Chat not found"
@@ -240,12 +385,15 @@ async def leave_chat(
         )
     
     chat.participants.remove(current_user)
+    chat_version = bump_chat_version(db, chat.id)
     db.commit()
+    await publish_participant_removed(id, chat_version, current_user.id)
     
     # If only one or no participants left, delete the chat
     if len(chat.participants) <= 1:
-        db.delete(chat)
+        schedule_chat_purge(db, chat)
         db.commit()
+        await publish_chat_deleted(id, chat_version)
         return Response(status_code=status.HTTP_204_NO_CONTENT)
     
     # Return success message
@@ -259,7 +407,7 @@ async def delete_chat(
 ):
     """Delete a chat (only if you're a participant)"""
     chat = db.get(Chat, id)
-    if not chat:
+    if not chat or chat.deleted_at:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail="Chat not found"
@@ -271,27 +419,55 @@ async def delete_chat(
             detail="You are not allowed to delete this chat"
         )
     
-    db.delete(chat)
+    chat_version = chat.version
+    schedule_chat_purge(db, chat)
     db.commit()
+    await publish_chat_deleted(id, chat_version)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 
-@router.get('/{id}/participants', status_code=status.HTTP_200_OK, response_model=List[dict])
-async def get_chat_participants(
+@router.post('/{id}/read',status_code=status.HTTP_202_ACCEPTED,dependencies=[Depends(query_budget(3))])
+async def mark_chat_read(
     id: int,
+    request: MarkReadRequest,
     db: Session = Depends(get_session),
     current_user: User = Depends(get_current_user)
+):
+    """Move the current user's read high-water mark forward (applied in batches)"""
+    participant = db.get(ChatParticipant, (current_user.id, id))
+    chat = db.get(Chat, id)
+    if not participant or chat.deleted_at:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, 
+            detail="Chat not found"
+        )
+    
+    read_marks.mark(id, current_user.id, request.message_id)
+    return {"message": "Read position accepted"}
+
+@router.get('/{id}/participants', status_code=status.HTTP_200_OK, response_model=List[dict], dependencies=[Depends(query_budget(5))])
+async def get_chat_participants(
+    id: int,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_session),
+    current_user: User = Depends(get_current_user)
 ):
     """Get all participants of a specific chat"""
+    not_modified = check_not_modified(request, response, db, id, current_user.id, "participants")
+    if not_modified:
+        return not_modified
+    
     chat = db.get(Chat, id)
-    if not chat:
+    if not chat or chat.deleted_at:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail="Chat not found"
         )
     
-    if current_user not in chat.participants:
+    # Membership by id: current_user is bound to the primary session, chat may come from the replica
+    if not db.get(ChatParticipant, (current_user.id, id)):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, 
             detail="You are not a participant in this chat"
@@ -1,12 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException,status, Query, Response,WebSocket,WebSocketDisconnect
-from typing import List,Annotated
+from fastapi import APIRouter, Depends, HTTPException,status, Query, Response, Request,WebSocket,WebSocketDisconnect
+from typing import List,Annotated,Union
 from sqlmodel import Session,select
-import json
-from app.databases import get_session
-from app.model import User, Message,Chat
-from app.schemas import MessageCreate,MessageRead,MessageUpdate
+from sqlalchemy import update
+from app.config import settings
+from app.databases import engine,get_session
+from app.replica import get_read_session
+from app.model import User, Message,Chat,ChatParticipant
+from app.schemas import MessageCreate,MessageRead,MessageUpdate,UserRead,MessagePage,MessageReadCompact
 from app.oauth2 import get_current_user, get_current_user_websocket
 from app.websockets import manager
+from app.read_state import read_marks
+from app.partitions import ArchiveUnavailable,archived_message_count,iter_archived_messages
+from app.versioning import check_not_modified
+from app.moderation import moderator
+from app.analytics import rollups
+from app.events import chat_event,publish
+from app.normalized import users_by_id
+from app.sharding import commit_message_write,find_message,message_session
+from app.schemas import ViolationStatus
+import asyncio
 
 
 
@@ -15,8 +27,98 @@ router = APIRouter(prefix='/messages',tags=['messages'])
 
 
 
+def _member_chat_ids(user_id : int, chat_ids) -> set:
+  """One query for every requested room the user may subscribe to"""
+  with Session(engine) as db:
+    return set(db.exec(
+      select(ChatParticipant.chat_id)
+      .join(Chat, Chat.id == ChatParticipant.chat_id)
+      .where(ChatParticipant.user_id == user_id, ChatParticipant.chat_id.in_(chat_ids), Chat.deleted_at.is_(None))
+    ).all())
+
+
+def _count_violation(user_id : int):
+  """Global write for commit_message_write(), safe to re-apply when its commit is retried"""
+  return lambda session: session.execute(
+    update(User).where(User.id == user_id).values(violation_count=User.violation_count + 1)
+  )
+
+
+def _live_content(message : Message) -> str | None:
+  """Content for room broadcasts: rejected messages reach other members without their text"""
+  return None if message.violation_status == ViolationStatus.REJECTED else message.content
+
+
+def _requested_chat_ids(frame : dict) -> list:
+  chat_ids = frame.get("chat_ids")
+  if not isinstance(chat_ids, list):
+    return []
+  return list({chat_id for chat_id in chat_ids if isinstance(chat_id, int)})
+
+
+@router.websocket('/ws')
+async def user_websocket_endpoint(websocket : WebSocket):
+  """One socket per user, multiplexing any number of chats.
+
+  Clients send {"type": "subscribe" | "unsubscribe", "chat_ids": [...]}; the
+  server answers with the granted and denied ids. Typing, presence and read
+  frames carry the chat_id they apply to.
+  """
+  if manager.draining:
+    await websocket.close(code=1012, reason="Server restarting")
+    return
+  with Session(engine) as db:
+    current_user = await get_current_user_websocket(websocket, db)
+    if not current_user:
+      return
+    if current_user.is_banned:
+      await websocket.close(code=4003, reason="You have been banned")
+      return
+    user_id = current_user.id
+  
+  await manager.connect_user(websocket, user_id)
+  try:
+    while True:
+      frame = await manager.receive(websocket)
+      if frame is None:
+        continue
+      frame_type = frame.get("type")
+      if frame_type == "subscribe":
+        requested = _requested_chat_ids(frame)
+        room_left = settings.WS_MAX_SUBSCRIPTIONS - len(manager.subscriptions(websocket))
+        allowed = await asyncio.to_thread(_member_chat_ids, user_id, requested[:max(room_left, 0)]) if requested else set()
+        manager.subscribe(websocket, allowed)
+        await manager.send_to_socket(websocket, {
+          "type": "subscribed",
+          "chat_ids": sorted(allowed),
+          "denied": sorted(set(requested) - allowed)
+        })
+      elif frame_type == "unsubscribe":
+        requested = _requested_chat_ids(frame)
+        manager.unsubscribe(websocket, requested)
+        await manager.send_to_socket(websocket, {"type": "unsubscribed", "chat_ids": sorted(requested)})
+      elif isinstance(frame.get("chat_id"), int) and frame["chat_id"] in manager.subscriptions(websocket):
+        # Frames for rooms this socket has not subscribed to, or with a malformed chat_id, are ignored
+        chat_id = frame["chat_id"]
+        if frame_type == "typing":
+          manager.set_typing(chat_id, user_id, bool(frame.get("is_typing", True)))
+        elif frame_type == "presence":
+          manager.set_presence(chat_id, user_id, frame.get("status"))
+        elif frame_type == "read" and isinstance(frame.get("message_id"), int):
+          read_marks.mark(chat_id, user_id, frame["message_id"])
+  except WebSocketDisconnect:
+    print(f"User {user_id} disconnected")
+  except Exception as e:
+    print(f"WebSocket error: {e}")
+  finally:
+    manager.close_socket(websocket)
+
+
 @router.websocket('/ws/{chat_id}')
 async def websocket_endpoint(websocket : WebSocket, chat_id : int):
+  if manager.draining:
+    await websocket.close(code=1012, reason="Server restarting")
+    return
   db = None
   try:
     # Get database session
@@ -27,9 +129,13 @@ async def websocket_endpoint(websocket : WebSocket, chat_id : int):
     if not current_user:
       return
     
+    if current_user.is_banned:
+      await websocket.close(code=4003, reason="You have been banned")
+      return
+    
     # Check if user is participant in the chat
     db_chat = db.get(Chat, chat_id)
-    if not db_chat:
+    if not db_chat or db_chat.deleted_at:
       await websocket.close(code=4004, reason="Chat not found")
       return
     
@@ -38,13 +144,20 @@ async def websocket_endpoint(websocket : WebSocket, chat_id : int):
       return
     
     # Connect to WebSocket
-    await manager.connect(websocket, chat_id)
+    await manager.connect(websocket, chat_id, current_user.id)
     print(f"User {current_user.name} connected to chat {chat_id}")
     
     while True:
-      data = await websocket.receive_text()
-      print(f"Received message in chat {chat_id}: {data}")
-      # Echo back or handle the message as needed
+      frame = await manager.receive(websocket)
+      if frame is None:
+        continue
+      # Presence and typing are kept in memory only, never written to the database
+      if frame.get("type") == "typing":
+        manager.set_typing(chat_id, current_user.id, bool(frame.get("is_typing", True)))
+      elif frame.get("type") == "presence":
+        manager.set_presence(chat_id, current_user.id, frame.get("status"))
+      elif frame.get("type") == "read" and isinstance(frame.get("message_id"), int):
+        read_marks.mark(chat_id, current_user.id, frame["message_id"])
       
   except WebSocketDisconnect:
     manager.disconnect(websocket, chat_id)
@@ -60,39 +173,79 @@ async def websocket_endpoint(websocket : WebSocket, chat_id : int):
     
     
 
-@router.get('/{chat_id}',status_code=status.HTTP_200_OK,response_model=List[MessageRead])
-async def get_messages(chat_id : int,db : Session = Depends(get_session),offset : int=0, limit : Annotated[int,Query(le=100)]=100,current_user : User = Depends(get_current_user)):
+@router.get('/{chat_id}',status_code=status.HTTP_200_OK,response_model=Union[MessagePage,List[MessageRead]])
+async def get_messages(chat_id : int,request : Request,response : Response,db : Session = Depends(get_read_session),mdb : Session = Depends(message_session(get_read_session)),offset : int=0, limit : Annotated[int,Query(le=100)]=100,normalized : bool=False,current_user : User = Depends(get_current_user)):
+    """With normalized=true, messages carry only sender_id and each sender appears once in `users`"""
+    not_modified = check_not_modified(request, response, db, chat_id, current_user.id, f"messages-{offset}-{limit}{'-n' if normalized else ''}")
+    if not_modified:
+        return not_modified
+    
     db_chat = db.get(Chat,chat_id)
-    if not db_chat:
+    if not db_chat or db_chat.deleted_at:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found")
-    if current_user not in db_chat.participants:
+    # Membership by id: current_user is bound to the primary session, chat may come from the replica
+    if not db.get(ChatParticipant, (current_user.id, chat_id)):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not a participant in this chat")
-    statement = select(Message).where(Message.chat_id == chat_id).order_by(Message.created_at.asc()).offset(offset).limit(limit)
-    results = db.exec(statement).all()  
-    return results
+    # History is archived oldest-first, so low offsets page into the archive before live rows
+    archived_total = archived_message_count(db, chat_id)
+    records = []
+    if offset < archived_total:
+        try:
+            for record in iter_archived_messages(db, chat_id, skip=offset):
+                records.append(record)
+                if len(records) >= limit:
+                    break
+        except ArchiveUnavailable as e:
+            print(f"Archived history of chat {chat_id} unavailable: {e}")
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Archived history is temporarily unavailable")
+    
+    live = []
+    remaining = limit - len(records)
+    if remaining > 0:
+        # mdb is db itself unless the chat's messages live on a shard
+        statement = select(Message).where(Message.chat_id == chat_id).order_by(Message.created_at.asc()).offset(max(offset - archived_total, 0)).limit(remaining)
+        live = [message.model_dump() for message in mdb.exec(statement).all()]
+    
+    # Senders come from the global database in one bulk fetch, wherever the messages live
+    rows = [*records, *live]
+    senders = users_by_id(db, (row["sender_id"] for row in rows))
+    rows = [row for row in rows if row["sender_id"] in senders]
+    if normalized:
+        return MessagePage(messages=[MessageReadCompact(**row) for row in rows], users=senders)
+    return [MessageRead(**row, sender=senders[row["sender_id"]]) for row in rows]
   
 @router.post('/{chat_id}',status_code=status.HTTP_201_CREATED,response_model=MessageRead)
-async def create_message(chat_id : int, message : MessageCreate, db : Session = Depends(get_session),current_user : User = Depends(get_current_user)):
+async def create_message(chat_id : int, message : MessageCreate, db : Session = Depends(get_session),mdb : Session = Depends(message_session()),current_user : User = Depends(get_current_user)):
   db_chat = db.get(Chat,chat_id)
-  if not db_chat:
+  if not db_chat or db_chat.deleted_at:
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found")
   
   if current_user not in db_chat.participants:
     raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not a participant in this chat")
   
-  db_message = Message.model_validate(message,update={"chat_id": chat_id, "sender_id": current_user.id})
+  db_message = Message.model_validate(message,update={
+    "chat_id": chat_id,
+    "sender_id": current_user.id,
+    "violation_status": moderator.moderate(message.content)
+  })
+  global_writes = None
+  if db_message.violation_status == ViolationStatus.REJECTED:
+    global_writes = _count_violation(current_user.id)
   
-  db.add(db_message)
-  db.commit()
-  db.refresh(db_message)
+  mdb.add(db_message)
+  # One transaction for unsharded chats; shard first, then counters and version globally otherwise
+  commit_message_write(db, mdb, chat_id, global_writes)
+  mdb.refresh(db_message)
+  rollups.record_message(db_message)
   
   # Send structured message data to WebSocket clients
   message_data = {
     "type": "new_message",
     "message": {
       "id": db_message.id,
-      "content": db_message.content,
+      "content": _live_content(db_message),
       "created_at": db_message.created_at.isoformat(),
+      "violation_status": db_message.violation_status,
       "sender": {
         "id": current_user.id,
         "name": current_user.name,
@@ -101,36 +254,64 @@ async def create_message(chat_id : int, message : MessageCreate, db : Session =
     }
   }
   
-  await manager.broadcast(json.dumps(message_data), chat_id)
-  return db_message
+  await manager.broadcast(message_data, chat_id)
+  return MessageRead(**db_message.model_dump(), sender=UserRead.model_validate(current_user))
 
 @router.patch('/{message_id}',response_model=MessageRead)
 async def update_message(message_id : int, message_update:MessageUpdate,db : Session = Depends(get_session),current_user : User = Depends(get_current_user)):
-    db_message = db.get(Message,message_id)
-    if not db_message:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message not found")
-    
-    if db_message.sender_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not allowed to update this message")
-    
-    update_data = message_update.model_dump(exclude_unset=True)
-    db_message.sqlmodel_update(update_data)
-    
-    db.commit()
-    db.refresh(db_message)
-    
-    return db_message
+    mdb, db_message = find_message(db, message_id)
+    try:
+        if not db_message:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message not found")
+        
+        if db_message.sender_id != current_user.id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not allowed to update this message")
+        
+        update_data = message_update.model_dump(exclude_unset=True)
+        old_status = db_message.violation_status
+        global_writes = None
+        if update_data.get("content") is not None:
+            # Edited content goes through moderation again
+            update_data["violation_status"] = moderator.moderate(update_data["content"])
+            # Same accounting as create_message: an edit that newly becomes a violation counts once
+            if update_data["violation_status"] == ViolationStatus.REJECTED and old_status != ViolationStatus.REJECTED:
+                global_writes = _count_violation(current_user.id)
+        db_message.sqlmodel_update(update_data)
+        mdb.add(db_message)
+        chat_version = commit_message_write(db, mdb, db_message.chat_id, global_writes)
+        mdb.refresh(db_message)
+        rollups.record_status_change(db_message, old_status)
+        
+        await publish(chat_event("message_edited", db_message.chat_id, chat_version, message={
+          "id": db_message.id,
+          "content": _live_content(db_message),
+          "violation_status": db_message.violation_status
+        }))
+        return MessageRead(**db_message.model_dump(), sender=UserRead.model_validate(current_user))
+    finally:
+        if mdb is not db:
+            mdb.close()
   
 @router.delete('/{message_id}',status_code=status.HTTP_204_NO_CONTENT)
 async def delete_message(message_id : int, db : Session = Depends(get_session),current_user : User = Depends(get_current_user)):
-    db_message = db.get(Message,message_id)
-    if not db_message:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message not found")
-    
-    if db_message.sender_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not allowed to delete this message")
+    mdb, db_message = find_message(db, message_id)
+    try:
+        if not db_message:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message not found")
+        
+        if db_message.sender_id != current_user.id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not allowed to delete this message")
+        
+        chat_id = db_message.chat_id
+        # Detached copy for the rollups, which are only adjusted once the delete has committed
+        deleted = Message(**db_message.model_dump())
+        mdb.delete(db_message)
+        chat_version = commit_message_write(db, mdb, chat_id)
+    finally:
+        if mdb is not db:
+            mdb.close()
+    rollups.record_deletion(deleted)
     
-    db.delete(db_message)
-    db.commit()
+    await publish(chat_event("message_deleted", chat_id, chat_version, message_id=message_id))
     
-    return Response(status_code=status.HTTP_204_NO_CONTENT)  
\ No newline at end of file
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
@@ -1,11 +1,15 @@
 from fastapi import APIRouter,Depends,status,Query,HTTPException,Response
 from app.databases import get_session
+from app.replica import get_read_session
 from sqlmodel import Session,select,or_
 from typing import Annotated,List
 from app.model import User
 from app.schemas import UserRead,UserCreate,UserUpdate,UserReadWithAdminInfo,AdminUserUpdate
 from app.utils import pwd_context
 from app.oauth2 import get_current_user,get_admin_user
+from app.purge import schedule_user_purge
+from app.versioning import bump_user_chat_versions
+from app.websockets import manager
 router = APIRouter(prefix="/users")
 
 
@@ -13,7 +17,7 @@ router = APIRouter(prefix="/users")
 
 @router.get("/admin",response_model=list[UserReadWithAdminInfo],tags=["admin"])
 async def get_users_as_admin(
-    db: Session = Depends(get_session),
+    db: Session = Depends(get_read_session),
     offset: int = 0,
     limit: Annotated[int, Query(le=100)] = 100,
     current_user: User = Depends(get_admin_user)
@@ -22,7 +26,7 @@ async def get_users_as_admin(
     return all_users
   
 @router.get("/admin/{id}",response_model=UserReadWithAdminInfo,tags=["admin"])
-async def get_user_as_admin(id : int, db : Session = Depends(get_session),current_user : User = Depends(get_admin_user)):
+async def get_user_as_admin(id : int, db : Session = Depends(get_read_session),current_user : User = Depends(get_admin_user)):
   user = db.get(User,id)
   if not user:
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="User not found")
@@ -36,18 +40,25 @@ async def update_user_as_admin(updateUser : AdminUserUpdate,id : int,db : Sessio
   
   update_data = updateUser.model_dump(exclude_unset=True)
   db_user.sqlmodel_update(update_data)
+  if "name" in update_data or "email" in update_data:
+    bump_user_chat_versions(db, db_user.id)
   
   db.add(db_user)
   db.commit()
   db.refresh(db_user)
   
+  # Banned users lose every live socket now rather than on their next reconnect
+  if update_data.get("is_banned"):
+    await manager.send_to_user(db_user.id, {"type": "moderation", "action": "banned"})
+    await manager.disconnect_user(db_user.id, code=4003, reason="You have been banned")
+  
   return db_user
 
 
 #--USER ROUTES--
 @router.get("/",status_code=status.HTTP_200_OK,response_model=List[UserRead],tags=["users"])
 async def get_users(db : Session = Depends(get_session),offset : int =0,limit : Annotated[int,Query(le=100)]=100):
-  all_users = db.exec(select(User).where(User.is_admin == False).offset(offset).limit(limit)).all()
+  all_users = db.exec(select(User).where(User.is_admin == False, User.deleted_at.is_(None)).offset(offset).limit(limit)).all()
   return all_users
 
 @router.post('/',status_code=status.HTTP_201_CREATED,response_model=UserRead,tags=["users"])
@@ -72,12 +83,13 @@ async def get_current_user_profile(current_user: User = Depends(get_current_user
 
 
 @router.get('/search',status_code=status.HTTP_200_OK,response_model=List[UserRead],tags=["users"])
-async def search_users(q:str,db : Session = Depends(get_session),offset : int =0,limit : int = 100,current_user : User = Depends(get_current_user)):
+async def search_users(q:str,db : Session = Depends(get_read_session),offset : int =0,limit : int = 100,current_user : User = Depends(get_current_user)):
   search_term = f"%{q}%"
   
   statement = (select(User).where(
     or_(User.name.ilike(search_term),User.email.ilike(search_term)),
-    User.is_admin == False
+    User.is_admin == False,
+    User.deleted_at.is_(None)
   ).offset(offset).limit(limit))
   results = db.exec(statement).all()
   return results
@@ -98,7 +110,7 @@ async def get_user(id : int,db : Session = Depends(get_session),current_user : U
 async def update_user(id : int,user : UserUpdate,db : Session = Depends(get_session),current_user : User = Depends(get_current_user)):
   if id != current_user.id:
     raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="You are not allowed to update this user")
-  db_user = db.exec(select(User).where(User.id == id, User.is_admin == False)).first()
+  db_user = db.exec(select(User).where(User.id == id, User.is_admin == False, User.deleted_at.is_(None))).first()
   if not db_user:
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="User not found")
   
@@ -108,6 +120,8 @@ async def update_user(id : int,user : UserUpdate,db : Session = Depends(get_sess
     db_user.password=  hashed_password
     del update_user["password"]
   db_user.sqlmodel_update(update_user)
+  if "name" in update_user or "email" in update_user:
+    bump_user_chat_versions(db, db_user.id)
   db.add(db_user)
   db.commit() 
   db.refresh(db_user)
@@ -118,12 +132,14 @@ async def update_user(id : int,user : UserUpdate,db : Session = Depends(get_sess
 async def delete_user(id : int,db : Session = Depends(get_session),current_user : User = Depends(get_current_user)):
   if id != current_user.id:
     raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="You are not allowed to delete this user")
-  db_user = db.exec(select(User).where(User.id == id, User.is_admin == False)).first()
+  db_user = db.exec(select(User).where(User.id == id, User.is_admin == False, User.deleted_at.is_(None))).first()
   if not db_user:
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="User not found")
   
-  db.delete(db_user)
+  schedule_user_purge(db, db_user)
   db.commit()
+  # Like a ban: live sockets close now, and reconnects fail authentication once deleted_at is set
+  await manager.disconnect_user(id, code=4003, reason="Account deleted")
   return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
@@ -1,8 +1,10 @@
-from pydantic import BaseModel, EmailStr
-from datetime import datetime
-from typing import List
+from pydantic import BaseModel, EmailStr, Field, field_validator, model_validator
+from datetime import datetime, date
+from typing import Dict, List
 from enum import Enum
 
+from app.config import settings
+
 class ViolationStatus(str, Enum):
     PENDING_REVIEW = "pending_review"
     APPROVED = "approved"
@@ -76,6 +78,31 @@ class ChatRead(ChatBase):
     class Config:
         from_attributes = True
 
+# Normalized shapes: messages reference sender_id and each user appears once in `users`
+class MessageReadCompact(MessageBase):
+    id: int
+    created_at: datetime
+    sender_id: int
+    violation_status: ViolationStatus
+    class Config:
+        from_attributes = True
+
+# No defaults on the id/user fields, so an ORM Chat never validates as the normalized shape
+class MessagePage(BaseModel):
+    messages: List[MessageReadCompact]
+    users: Dict[int, UserRead]
+
+class ChatReadNormalized(ChatBase):
+    id: int
+    created_at: datetime
+    participant_ids: List[int]
+    messages: List[MessageReadCompact]
+    users: Dict[int, UserRead]
+
+class ChatReadWithUnread(ChatRead):
+    unread_count : int = 0
+    # Config is inherited from ChatRead
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -87,6 +114,39 @@ class TokenData(BaseModel):
 class AddParticipantRequest(BaseModel):
     user_email: EmailStr
 
+class BulkParticipantsRequest(BaseModel):
+    # Bounded: one request is one transaction and one broadcast
+    user_ids: List[int] = Field(default=[], max_length=settings.BULK_PARTICIPANTS_MAX)
+    user_emails: List[EmailStr] = Field(default=[], max_length=settings.BULK_PARTICIPANTS_MAX)
+
+    @field_validator("user_ids", "user_emails")
+    @classmethod
+    def no_duplicates(cls, values):
+        if len({str(value).lower() for value in values}) != len(values):
+            raise ValueError("must not contain duplicates")
+        return values
+
+    @model_validator(mode="after")
+    def within_limit(self):
+        total = len(self.user_ids) + len(self.user_emails)
+        if total == 0:
+            raise ValueError("name at least one user in user_ids or user_emails")
+        if total > settings.BULK_PARTICIPANTS_MAX:
+            raise ValueError(f"at most {settings.BULK_PARTICIPANTS_MAX} users per request")
+        return self
+
+class ParticipantDelta(BaseModel):
+    """Only what changed: ids/emails that matched no user are listed in `not_found`"""
+    chat_id: int
+    chat_version: int
+    added: List[UserRead] = []
+    removed: List[int] = []
+    not_found: List[int | str] = []
+    chat_deleted: bool = False
+
+class MarkReadRequest(BaseModel):
+    message_id: int
+
 class ChatSummary(BaseModel):
     """Lightweight chat summary without full message/participant data"""
     id: int
@@ -96,4 +156,45 @@ class ChatSummary(BaseModel):
     last_message_at: datetime | None = None
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class PurgeJobRead(BaseModel):
+    id: int
+    kind: str
+    target_id: int
+    status: str
+    messages_deleted: int
+    participants_deleted: int
+    error: str | None = None
+    created_at: datetime
+    updated_at: datetime
+    finished_at: datetime | None = None
+
+    class Config:
+        from_attributes = True
+
+class BulkImportRowError(BaseModel):
+    row: int
+    email: str | None = None
+    status: str
+    error: str
+
+class BulkImportReport(BaseModel):
+    created: int
+    skipped: int
+    failed: int
+    errors: List[BulkImportRowError] = []
+
+class DailyViolationStats(BaseModel):
+    day: date
+    total: int
+    pending_review: int
+    approved: int
+    rejected: int
+
+    class Config:
+        from_attributes = True
+
+class ChatActivity(BaseModel):
+    chat_id: int
+    message_count: int
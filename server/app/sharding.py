@@ -0,0 +1,354 @@
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+from fastapi import Depends, HTTPException, status
+from sqlalchemy import ForeignKeyConstraint, MetaData, and_, event, func, insert, or_, text, update
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, create_engine, select
+
+from app.config import settings
+from app.databases import engine, get_session
+from app.model import Chat, Message
+from app.versioning import bump_chat_version
+
+
+# Optional message shards. Users, chats and chat_participant stay in the global
+# database (DATABASE_URL), which doubles as the chat -> shard directory via
+# Chat.shard and as every user's chat directory via chat_participant. Only
+# message rows, the bulk of the write volume, are spread across shards.
+# Chat.shard is None for chats whose messages live in the global database,
+# which is every chat when SHARD_DATABASE_URLS is empty.
+shard_engines : List[Engine] = [create_engine(url) for url in settings.SHARD_DATABASE_URLS]
+
+
+def enabled() -> bool:
+  return bool(shard_engines)
+
+def place_chat(chat_id : int) -> int | None:
+  """Shard a new chat's messages go to"""
+  return chat_id % len(shard_engines) if shard_engines else None
+
+def engine_for(shard : int | None) -> Engine:
+  return engine if shard is None else shard_engines[shard]
+
+def shard_of_message_id(message_id : int) -> int | None:
+  """Where a message was first written: shard k allocates ids from (k + 1) * SHARD_ID_SPAN.
+  Only a hint, since rebalancing moves messages with their ids."""
+  shard = message_id // settings.SHARD_ID_SPAN - 1
+  return shard if 0 <= shard < len(shard_engines) else None
+
+
+def shard_session(shard : int) -> Session:
+  """Session on a shard; it records the shard so commit_message_write() can tell if the chat moved away"""
+  return Session(shard_engines[shard], info={"shard": shard})
+
+
+def message_session(base = get_session):
+  """Route dependency yielding the session that holds a chat's messages.
+
+  Unsharded chats get the request's `base` session itself, so single-database
+  deployments behave exactly as before, one transaction and no extra query.
+  """
+  def dependency(chat_id : int, db : Session = Depends(base)):
+    shard = db.exec(select(Chat.shard).where(Chat.id == chat_id)).first() if shard_engines else None
+    if shard is None:
+      yield db
+      return
+    with shard_session(shard) as session:
+      yield session
+  return dependency
+
+
+def find_message(db : Session, message_id : int) -> Tuple[Session, Message | None]:
+  """Locates a message by id alone: global database first, then the shard its id
+  range points to, then every other shard. A copy left behind by an unfinished
+  move_chat() is skipped for the chat's current location. The caller closes a
+  returned shard session."""
+  message = db.get(Message, message_id)
+  if not shard_engines:
+    return db, message
+  session = db
+  if message is None:
+    hint = shard_of_message_id(message_id)
+    order = ([hint] if hint is not None else []) + [k for k in range(len(shard_engines)) if k != hint]
+    for shard in order:
+      session = shard_session(shard)
+      message = session.get(Message, message_id)
+      if message is not None:
+        break
+      session.close()
+    else:
+      return db, None
+
+  current = db.exec(select(Chat.shard).where(Chat.id == message.chat_id)).first()
+  if current == session.info.get("shard"):
+    return session, message
+  if session is not db:
+    session.close()
+  session = db if current is None else shard_session(current)
+  return session, session.get(Message, message_id)
+
+
+def commit_message_write(db : Session, mdb : Session, chat_id : int, global_writes : Callable[[Session], None] | None = None, attempts : int = 3) -> int:
+  """Commits a message write and the chat's version bump, the global side last and retried; returns the version"""
+  # global_writes(session) applies the write's other global changes (counters) and
+  # is re-applied on retry. The bump row-locks the chat until the global commit,
+  # which move_chat() waits on; a write routed before a move flipped the chat is
+  # refused with 409.
+  if global_writes is not None:
+    global_writes(db)
+  version = bump_chat_version(db, chat_id)
+  if shard_engines and db.exec(select(Chat.shard).where(Chat.id == chat_id)).first() != mdb.info.get("shard"):
+    mdb.rollback()
+    db.rollback()
+    raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Chat messages were moved, retry the request")
+  if mdb is db:
+    db.commit()
+    return version
+
+  try:
+    mdb.commit()
+  except Exception:
+    db.rollback()
+    raise
+  try:
+    db.commit()
+    return version
+  except Exception as e:
+    db.rollback()
+    print(f"Global commit after shard write to chat {chat_id} failed, retrying: {e}")
+  for attempt in range(1, attempts + 1):
+    try:
+      with Session(engine) as session:
+        if global_writes is not None:
+          global_writes(session)
+        version = bump_chat_version(session, chat_id)
+        session.commit()
+        return version
+    except Exception as e:
+      if attempt == attempts:
+        raise
+      print(f"Version bump retry {attempt} for chat {chat_id} failed: {e}")
+      time.sleep(0.1 * attempt)
+
+
+def unread_counts(db : Session, user_id : int, last_read : Dict[int, int | None]) -> Dict[int, int]:
+  """Unread counts for sharded chats, one grouped query per shard.
+
+  `last_read` maps chat ids to the user's high-water mark (from the global
+  chat_participant rows); chats without a shard are skipped.
+  """
+  by_shard : Dict[int, List[int]] = {}
+  for chat_id, shard in db.exec(select(Chat.id, Chat.shard).where(Chat.id.in_(last_read), Chat.shard.is_not(None))).all():
+    by_shard.setdefault(shard, []).append(chat_id)
+
+  counts : Dict[int, int] = {}
+  for shard, chat_ids in by_shard.items():
+    with Session(shard_engines[shard]) as session:
+      counts.update(session.exec(
+        select(Message.chat_id, func.count(Message.id))
+        .where(
+          or_(*(and_(Message.chat_id == chat_id, Message.id > (last_read[chat_id] or 0)) for chat_id in chat_ids)),
+          Message.sender_id != user_id
+        )
+        .group_by(Message.chat_id)
+      ).all())
+  return counts
+
+
+# --- Shard schema and rebalancing ---
+
+def _shard_metadata() -> MetaData:
+  """The message table alone, minus foreign keys that point into the global database"""
+  metadata = MetaData()
+  table = Message.__table__.to_metadata(metadata)
+  for constraint in [c for c in table.constraints if isinstance(c, ForeignKeyConstraint)]:
+    table.constraints.discard(constraint)
+  for column in table.columns:
+    column.foreign_keys.clear()
+  table.foreign_keys.clear()
+  return metadata
+
+
+BIGINT_MAX = 2**63 - 1
+
+
+def _id_sequence(conn) -> str:
+  return conn.execute(text("SELECT pg_get_serial_sequence('message', 'id')")).scalar_one()
+
+
+def reserve_global_ids():
+  """Caps the global database's message id sequence below the first shard range (PostgreSQL)"""
+  if engine.dialect.name != "postgresql":
+    return
+  with engine.begin() as conn:
+    sequence = _id_sequence(conn)
+    last = conn.execute(text(f"SELECT last_value FROM {sequence}")).scalar_one()
+    if last >= id_range(None)[1]:
+      raise RuntimeError(f"Global message ids already reach {last}; SHARD_ID_SPAN must exceed it")
+    conn.execute(text(f"ALTER SEQUENCE {sequence} MAXVALUE {id_range(None)[1] - 1}"))
+
+
+def id_range(shard : int | None) -> Tuple[int, int]:
+  """[start, end) of the ids a database allocates itself; the global database sits below the first shard"""
+  if shard is None:
+    return 1, settings.SHARD_ID_SPAN
+  start = (shard + 1) * settings.SHARD_ID_SPAN
+  return start, start + settings.SHARD_ID_SPAN
+
+
+# SQLite (development) has no bounded sequences, and both rowid and
+# AUTOINCREMENT continue after the largest id present, which rows copied in by
+# move_chat() push into another database's range. Each SQLite database instead
+# allocates from a one-row counter kept inside its own range.
+SQLITE_COUNTER_DDL = "CREATE TABLE IF NOT EXISTS message_id_counter (id INTEGER PRIMARY KEY CHECK (id = 0), last_id INTEGER NOT NULL)"
+
+def _seed_sqlite_counter(conn, shard : int | None):
+  start, end = id_range(shard)
+  conn.execute(text(SQLITE_COUNTER_DDL))
+  conn.execute(text(
+    "INSERT OR IGNORE INTO message_id_counter (id, last_id) SELECT 0, COALESCE(MAX(id), :start - 1) FROM message WHERE id >= :start AND id < :end"
+  ), {"start": start, "end": end})
+
+def _next_sqlite_id(conn, shard : int | None) -> int:
+  _seed_sqlite_counter(conn, shard)
+  conn.execute(text("UPDATE message_id_counter SET last_id = last_id + 1 WHERE id = 0"))
+  last = conn.execute(text("SELECT last_id FROM message_id_counter WHERE id = 0")).scalar_one()
+  if last >= id_range(shard)[1]:
+    raise RuntimeError(f"Message id range of {'the global database' if shard is None else f'shard {shard}'} is exhausted")
+  return last
+
+@event.listens_for(Message, "before_insert")
+def _allocate_sqlite_id(mapper, connection, target):
+  if target.id is not None or not shard_engines or connection.dialect.name != "sqlite":
+    return
+  if connection.engine is engine:
+    target.id = _next_sqlite_id(connection, None)
+    return
+  for shard, shard_engine in enumerate(shard_engines):
+    if connection.engine is shard_engine:
+      target.id = _next_sqlite_id(connection, shard)
+      return
+
+
+def create_shard_schema(shard : int):
+  """Creates the message table on a shard and confines the ids it allocates to id_range(shard)"""
+  start, end = id_range(shard)
+  if end - 1 > BIGINT_MAX:
+    raise ValueError(f"Shard {shard} id range exceeds BIGINT; lower SHARD_ID_SPAN")
+  target = shard_engines[shard]
+  _shard_metadata().create_all(target)
+  with target.begin() as conn:
+    if target.dialect.name == "postgresql":
+      # Rows moved in from other databases keep their ids; only this range's own ids count.
+      # MINVALUE/MAXVALUE make a full range fail inserts instead of reaching the next shard's ids.
+      last = conn.execute(text("SELECT MAX(id) FROM message WHERE id >= :start AND id < :end"), {"start": start, "end": end}).scalar()
+      sequence = _id_sequence(conn)
+      conn.execute(text(
+        f"ALTER SEQUENCE {sequence} MINVALUE {start} MAXVALUE {end - 1} START WITH {start} RESTART WITH {(last or start - 1) + 1}"
+      ))
+    elif target.dialect.name == "sqlite":
+      _seed_sqlite_counter(conn, shard)
+
+
+def _copy_messages(source : Engine, target : Engine, chat_id : int, after_id : int, chunk_size : int) -> Tuple[int, int]:
+  """Copies messages with id > after_id, keeping their ids. Returns (rows copied, last id)."""
+  table = Message.__table__
+  copied = 0
+  while True:
+    with source.connect() as conn:
+      rows = [dict(row._mapping) for row in conn.execute(
+        table.select().where(table.c.chat_id == chat_id, table.c.id > after_id).order_by(table.c.id).limit(chunk_size)
+      )]
+    if not rows:
+      return copied, after_id
+    with target.begin() as conn:
+      conn.execute(insert(table), rows)
+    copied += len(rows)
+    after_id = rows[-1]["id"]
+
+
+def _resync_copied(source : Engine, target : Engine, chat_id : int, up_to_id : int, chunk_size : int):
+  """Re-applies to copied rows (id <= up_to_id) the edits and deletes made at the source since the copy"""
+  table = Message.__table__
+  after_id = 0
+  while True:
+    with target.connect() as conn:
+      copied = {row.id: dict(row._mapping) for row in conn.execute(
+        table.select().where(table.c.chat_id == chat_id, table.c.id > after_id, table.c.id <= up_to_id).order_by(table.c.id).limit(chunk_size)
+      )}
+    if not copied:
+      return
+    last_id = max(copied)
+    with source.connect() as conn:
+      current = {row.id: dict(row._mapping) for row in conn.execute(
+        table.select().where(table.c.chat_id == chat_id, table.c.id > after_id, table.c.id <= last_id)
+      )}
+    changed = [row for message_id, row in current.items() if copied.get(message_id) != row]
+    stale_ids = [row["id"] for row in changed] + [message_id for message_id in copied if message_id not in current]
+    if stale_ids:
+      with target.begin() as conn:
+        conn.execute(table.delete().where(table.c.id.in_(stale_ids)))
+        if changed:
+          conn.execute(insert(table), changed)
+    after_id = last_id
+
+
+def _delete_messages(source : Engine, chat_id : int, chunk_size : int):
+  table = Message.__table__
+  while True:
+    with source.begin() as conn:
+      ids = conn.execute(
+        select(table.c.id).where(table.c.chat_id == chat_id).limit(chunk_size)
+      ).scalars().all()
+      if not ids:
+        return
+      conn.execute(table.delete().where(table.c.id.in_(ids)))
+
+
+def move_chat(chat_id : int, shard : int | None, chunk_size : int = 1000, passes : int = 5) -> int:
+  """Moves a chat's messages to `shard` (None = global database). Returns rows copied."""
+  with Session(engine) as db:
+    chat = db.get(Chat, chat_id)
+    if chat is None or chat.shard == shard:
+      return 0
+    source_shard = chat.shard
+    source, target = engine_for(source_shard), engine_for(shard)
+
+  # Sync passes run without blocking writers. Every message write bumps Chat.version,
+  # so a version unchanged since a pass started means the copy is complete.
+  copied, last_id = 0, 0
+  for sync_pass in range(passes):
+    with Session(engine) as db:
+      version = db.exec(select(Chat.version).where(Chat.id == chat_id)).one()
+    count, resynced_to = _copy_messages(source, target, chat_id, last_id, chunk_size)
+    if sync_pass:
+      _resync_copied(source, target, chat_id, last_id, chunk_size)
+    copied, last_id = copied + count, resynced_to
+
+    with Session(engine) as db:
+      # The row lock writers hold from their version bump to their global commit
+      # (the database write lock on SQLite); only a check and the flip run under it
+      db.execute(update(Chat).where(Chat.id == chat_id).values(shard=Chat.shard))
+      current_shard, current_version = db.exec(select(Chat.shard, Chat.version).where(Chat.id == chat_id)).one()
+      if current_shard != source_shard:
+        db.rollback()
+        raise RuntimeError(f"Chat {chat_id} was moved concurrently, rerun the move")
+      if current_version == version:
+        db.execute(update(Chat).where(Chat.id == chat_id).values(shard=shard))
+        db.commit()
+        break
+      db.rollback()
+  else:
+    raise RuntimeError(f"Chat {chat_id} kept changing during {passes} sync passes, retry later")
+
+  # Writes routed to the old location now fail with 409, so nothing can land there anymore
+  _delete_messages(source, chat_id, chunk_size)
+  return copied
+
+
+def misplaced_chats(db : Session) -> Iterable[Tuple[int, int | None, int | None]]:
+  """(chat_id, current shard, placement shard) for live chats not where place_chat() puts them"""
+  for chat_id, shard in db.exec(select(Chat.id, Chat.shard).where(Chat.deleted_at.is_(None)).order_by(Chat.id)).all():
+    wanted = place_chat(chat_id)
+    if shard != wanted:
+      yield chat_id, shard, wanted
@@ -0,0 +1,55 @@
+from fastapi import Request, Response, status
+from sqlalchemy import update
+from sqlmodel import Session, select
+
+from app.model import Chat, ChatParticipant
+
+
+def bump_chat_version(db : Session, chat_id : int) -> int:
+  """Invalidates cached reads of a chat and returns the new version. Runs in the caller's transaction."""
+  return db.execute(
+    update(Chat).where(Chat.id == chat_id).values(version=Chat.version + 1).returning(Chat.version)
+  ).scalar_one()
+
+def bump_chat_versions(db : Session, chat_ids):
+  """Invalidates several chats at once. Runs in the caller's transaction."""
+  chat_ids = {chat_id for chat_id in chat_ids if chat_id is not None}
+  if chat_ids:
+    db.execute(update(Chat).where(Chat.id.in_(chat_ids)).values(version=Chat.version + 1))
+
+def bump_user_chat_versions(db : Session, user_id : int):
+  """Invalidates every chat that embeds this user's profile"""
+  chat_ids = select(ChatParticipant.chat_id).where(ChatParticipant.user_id == user_id)
+  db.execute(update(Chat).where(Chat.id.in_(chat_ids)).values(version=Chat.version + 1))
+
+
+def chat_etag(chat_id : int, version : int, variant : str = "") -> str:
+  return f'"chat-{chat_id}-v{version}{"-" + variant if variant else ""}"'
+
+def etag_matches(request : Request, etag : str) -> bool:
+  header = request.headers.get("if-none-match")
+  if not header:
+    return False
+  return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+
+def check_not_modified(request : Request, response : Response, db : Session, chat_id : int, user_id : int, variant : str = "") -> Response | None:
+  """Answers a conditional GET from the chat version alone, before any expensive query.
+
+  Returns a 304 response when the client's copy is current. Otherwise sets the
+  ETag on `response` and returns None; unknown chats and non-members fall
+  through so the route raises its usual 404/403.
+  """
+  version = db.exec(
+    select(Chat.version)
+    .join(ChatParticipant, ChatParticipant.chat_id == Chat.id)
+    .where(Chat.id == chat_id, ChatParticipant.user_id == user_id, Chat.deleted_at.is_(None))
+  ).first()
+  if version is None:
+    return None
+
+  etag = chat_etag(chat_id, version, variant)
+  if etag_matches(request, etag):
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+  response.headers["ETag"] = etag
+  return None
@@ -1,42 +1,393 @@
-from fastapi import WebSocket
-from typing import List, Dict
+from fastapi import WebSocket, WebSocketDisconnect
+from typing import Dict, Set
+import asyncio
+import json
+import random
+import time
+
+from app.config import settings
+from app import ws_protocol
+
+
+PRESENCE_STATUSES = ("online", "away")
+
+
+class ConnectionState:
+  """Per-socket bookkeeping: owner, rooms, negotiated framing and senders already sent to it"""
+  __slots__ = ("user_id", "chat_ids", "protocol", "multiplexed", "known_senders", "last_seen", "awaiting_pong", "deadline_tick")
+
+  def __init__(self, user_id : int, protocol : str | None, multiplexed : bool = False):
+    self.user_id = user_id
+    self.chat_ids : Set[int] = set()
+    self.protocol = protocol
+    # Multiplexed sockets outlive their subscriptions; per-chat sockets die with their room
+    self.multiplexed = multiplexed
+    self.known_senders : Set[int] = set()
+    self.last_seen = time.monotonic()
+    self.awaiting_pong = False
+    self.deadline_tick = 0
 
 
 class WebSocketManager:
   def __init__(self):
-    self.active_connections : Dict[int, List[WebSocket]] ={}
-    
-  async def connect(self, websocket : WebSocket,chat_id : int):
-    """Accepts a new Websocket connections and add it to a list of active connections for the chat"""
-    await websocket.accept()
-    if chat_id not in self.active_connections:
-      self.active_connections[chat_id] = []
-    self.active_connections[chat_id].append(websocket)
-    
+    self.active_connections : Dict[int, Set[WebSocket]] ={}
+    # Second index so user-targeted pushes never scan rooms
+    self.user_connections : Dict[int, Set[WebSocket]] = {}
+    self.connections : Dict[WebSocket, ConnectionState] = {}
+
+    # Ephemeral per-room state. Never persisted, rebuilt from live sockets.
+    self.presence : Dict[int, Dict[int, str]] = {}
+    self.typing : Dict[int, Dict[int, float]] = {}
+    self._dirty_rooms : Set[int] = set()
+    self._flusher : asyncio.Task | None = None
+
+    # Heartbeats: one shared timer wheel of tick -> sockets due, driven by a single task
+    self._wheel : Dict[int, Set[WebSocket]] = {}
+    self._heartbeat : asyncio.Task | None = None
+
+    # Set once the node starts draining; endpoints refuse new sockets from then on
+    self.draining = False
+
+  async def connect(self, websocket : WebSocket,chat_id : int, user_id : int):
+    """Accepts a new Websocket connections and add it to the set of active connections for the chat"""
+    await self._accept(websocket, ConnectionState(user_id, ws_protocol.negotiate(websocket)))
+    self.subscribe(websocket, [chat_id])
+
+  async def connect_user(self, websocket : WebSocket, user_id : int):
+    """Accepts a per-user socket that joins rooms later through subscribe()"""
+    await self._accept(websocket, ConnectionState(user_id, ws_protocol.negotiate(websocket), multiplexed=True))
+
+  async def _accept(self, websocket : WebSocket, state : ConnectionState):
+    await websocket.accept(subprotocol=state.protocol)
+    self.connections[websocket] = state
+    self.user_connections.setdefault(state.user_id, set()).add(websocket)
+    self._schedule(websocket, state, settings.WS_HEARTBEAT_INTERVAL)
+    self._ensure_flusher()
+
+  def subscribe(self, websocket : WebSocket, chat_ids):
+    """Adds an accepted socket to already-authorized rooms"""
+    state = self.connections.get(websocket)
+    if state is None:
+      return
+    for chat_id in chat_ids:
+      state.chat_ids.add(chat_id)
+      self.active_connections.setdefault(chat_id, set()).add(websocket)
+      self.set_presence(chat_id, state.user_id, "online")
+
+  def unsubscribe(self, websocket : WebSocket, chat_ids):
+    for chat_id in chat_ids:
+      self.disconnect(websocket, chat_id)
+
+  def subscriptions(self, websocket : WebSocket) -> Set[int]:
+    state = self.connections.get(websocket)
+    return state.chat_ids if state is not None else set()
+
   def disconnect(self, websocket : WebSocket,chat_id  :int):
-    """Removes a Websocket connection from the list of active connections for the chat"""
-    if chat_id in self.active_connections:
+    """Removes a Websocket connection from the set of active connections for the chat"""
+    room = self.active_connections.get(chat_id)
+    if room is not None:
+      room.discard(websocket)
+      # Remove empty chat rooms
+      if not room:
+        del self.active_connections[chat_id]
+
+    state = self.connections.get(websocket)
+    if state is None:
+      return
+    state.chat_ids.discard(chat_id)
+    if not state.chat_ids and not state.multiplexed:
+      self._release(websocket, state)
+    if not self._user_in_room(chat_id, state.user_id):
+      self._clear_user_state(chat_id, state.user_id)
+
+  def _release(self, websocket : WebSocket, state : ConnectionState):
+    del self.connections[websocket]
+    sockets = self.user_connections.get(state.user_id)
+    if sockets is not None:
+      sockets.discard(websocket)
+      if not sockets:
+        del self.user_connections[state.user_id]
+
+  async def receive(self, websocket : WebSocket) -> dict | None:
+    """Reads one inbound frame in the connection's framing. Returns None for unparseable frames."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+      raise WebSocketDisconnect(message.get("code", 1000))
+    # Any inbound frame (including pong) proves the socket is alive
+    state = self.connections.get(websocket)
+    if state is not None:
+      state.last_seen = time.monotonic()
+      state.awaiting_pong = False
+    try:
+      if message.get("bytes") is not None:
+        frame = ws_protocol.decode_binary(message["bytes"])
+      else:
+        text = message.get("text") or ""
+        if len(text) > settings.WS_MAX_INBOUND_FRAME_BYTES:
+          raise ws_protocol.FrameTooLarge("Text frame too large")
+        frame = json.loads(text)
+    except ws_protocol.FrameTooLarge:
+      # Oversized frames end the connection rather than being silently skipped
       try:
-        self.active_connections[chat_id].remove(websocket)
-        # Remove empty chat rooms
-        if not self.active_connections[chat_id]:
-          del self.active_connections[chat_id]
-      except ValueError:
-        # WebSocket not in list (already disconnected)
-        pass
-      
-  async def broadcast(self, message : str,chat_id : int):
+        await websocket.close(code=1009, reason="Frame too large")
+      except Exception:
+        pass  # Connection might already be closed
+      raise WebSocketDisconnect(1009)
+    except Exception:
+      return None
+    return frame if isinstance(frame, dict) else None
+
+  async def broadcast(self, message : dict,chat_id : int, exclude_user_ids : Set[int] = frozenset()):
     if chat_id in self.active_connections:
       # Create a copy of connections to avoid modification during iteration
-      connections = self.active_connections[chat_id].copy()
+      connections = list(self.active_connections[chat_id])
+      if exclude_user_ids:
+        connections = [ws for ws in connections if ws in self.connections and self.connections[ws].user_id not in exclude_user_ids]
+      # Each encoding is built at most once per broadcast and shared by every socket using it
+      encoded_json = None
+      compact, sender = ws_protocol.split_sender(message)
+      encoded_binary = None
+      sender_frame = None
       for connection in connections:
+        state = self.connections.get(connection)
         try:
-          await connection.send_text(message)
+          if state is None or state.protocol is None:
+            if encoded_json is None:
+              encoded_json = ws_protocol.encode_json(message)
+            await connection.send_text(encoded_json)
+            continue
+          # Binary clients get each sender once per connection, then only its id
+          if sender is not None and sender["id"] not in state.known_senders:
+            if sender_frame is None:
+              sender_frame = ws_protocol.encode_binary({"type": "user", "user": sender})
+            await connection.send_bytes(sender_frame)
+            state.known_senders.add(sender["id"])
+          if encoded_binary is None:
+            encoded_binary = ws_protocol.encode_binary(compact)
+          await connection.send_bytes(encoded_binary)
         except Exception as e:
           print(f"Error broadcasting to connection: {e}")
           # Remove failed connection
           self.disconnect(connection, chat_id)
-        
+
+  # --- User-targeted delivery ---
+
+  async def send_to_user(self, user_id : int, message : dict):
+    """Delivers an event to every socket of one user, whatever rooms they are in"""
+    for connection in list(self.user_connections.get(user_id, ())):
+      try:
+        await self._send(connection, message)
+      except Exception as e:
+        print(f"Error sending to user {user_id}: {e}")
+        self._forget(connection)
+
+  async def disconnect_user(self, user_id : int, code : int = 1008, reason : str = ""):
+    """Closes every socket of a user across all rooms immediately"""
+    for connection in list(self.user_connections.get(user_id, ())):
+      self._forget(connection)
+      try:
+        await connection.close(code=code, reason=reason)
+      except Exception:
+        pass  # Connection might already be closed
+
+  async def remove_user_from_room(self, user_id : int, chat_id : int, code : int = 4003, reason : str = "You are no longer a participant in this chat"):
+    """Stops delivering a room's traffic to a user who left or was removed"""
+    room = self.active_connections.get(chat_id, ())
+    await self._drop_from_room([ws for ws in self.user_connections.get(user_id, ()) if ws in room], chat_id, code, reason)
+
+  async def close_room(self, chat_id : int, code : int = 4004, reason : str = "Chat deleted"):
+    await self._drop_from_room(list(self.active_connections.get(chat_id, ())), chat_id, code, reason)
+
+  async def _drop_from_room(self, sockets, chat_id : int, code : int, reason : str):
+    for connection in sockets:
+      self.disconnect(connection, chat_id)
+      # Sockets still subscribed to other rooms stay open
+      if connection not in self.connections:
+        try:
+          await connection.close(code=code, reason=reason)
+        except Exception:
+          pass  # Connection might already be closed
+
+  async def send_to_socket(self, websocket : WebSocket, message : dict):
+    try:
+      await self._send(websocket, message)
+    except Exception as e:
+      print(f"Error sending to connection: {e}")
+      self._forget(websocket)
+
+  def close_socket(self, websocket : WebSocket):
+    """Drops a socket from every room and index once its handler exits"""
+    self._forget(websocket)
+
+  def _forget(self, websocket : WebSocket):
+    state = self.connections.get(websocket)
+    if state is not None:
+      for chat_id in list(state.chat_ids):
+        self.disconnect(websocket, chat_id)
+      if websocket in self.connections:
+        self._release(websocket, state)
+
+  async def _send(self, websocket : WebSocket, message : dict):
+    state = self.connections.get(websocket)
+    if state is not None and state.protocol is not None:
+      await websocket.send_bytes(ws_protocol.encode_binary(message))
+    else:
+      await websocket.send_text(ws_protocol.encode_json(message))
+
+  # --- Drain ---
+
+  async def drain(self, max_delay : float) -> int:
+    """Asks every socket to reconnect after a random delay, then closes it with 1012.
+
+    The jitter spreads the reconnects of a whole node over max_delay seconds
+    instead of landing them on the next node all at once. Returns sockets closed.
+    """
+    self.draining = True
+    await self.flush_presence()
+    sockets = list(self.connections)
+    await asyncio.gather(
+      *(self._send(ws, {"type": "reconnect", "after_ms": int(random.uniform(0, max_delay) * 1000)}) for ws in sockets),
+      return_exceptions=True
+    )
+    for websocket in sockets:
+      self._forget(websocket)
+    await asyncio.gather(
+      *(websocket.close(code=1012, reason="Server restarting") for websocket in sockets),
+      return_exceptions=True
+    )
+    return len(sockets)
+
+  # --- Heartbeats ---
+
+  def _schedule(self, websocket : WebSocket, state : ConnectionState, delay : float):
+    """Files the socket under the wheel slot for now + delay. Older slots are ignored lazily."""
+    tick = int((time.monotonic() + delay) / settings.WS_HEARTBEAT_TICK) + 1
+    state.deadline_tick = tick
+    self._wheel.setdefault(tick, set()).add(websocket)
+
+  async def _check_heartbeats(self, due : Dict[int, Set[WebSocket]]):
+    now = time.monotonic()
+    to_ping, expired = [], []
+    for tick, sockets in due.items():
+      for websocket in sockets:
+        state = self.connections.get(websocket)
+        if state is None or state.deadline_tick != tick:
+          continue  # Gone, or rescheduled into a later slot
+        idle = now - state.last_seen
+        if idle < settings.WS_HEARTBEAT_INTERVAL:
+          self._schedule(websocket, state, settings.WS_HEARTBEAT_INTERVAL - idle)
+        elif not state.awaiting_pong:
+          state.awaiting_pong = True
+          self._schedule(websocket, state, settings.WS_HEARTBEAT_TIMEOUT)
+          to_ping.append(websocket)
+        else:
+          expired.append(websocket)
+
+    # Reap in one batch: drop from every index first, then close concurrently
+    for websocket in expired:
+      self._forget(websocket)
+    await asyncio.gather(
+      *(websocket.close(code=4008, reason="Heartbeat timeout") for websocket in expired),
+      *(self._send(websocket, {"type": "ping"}) for websocket in to_ping),
+      return_exceptions=True
+    )
+
+  async def _heartbeat_loop(self):
+    tick = settings.WS_HEARTBEAT_TICK
+    current = int(time.monotonic() / tick)
+    while True:
+      await asyncio.sleep(tick)
+      target = int(time.monotonic() / tick)
+      due = {}
+      while current <= target:
+        sockets = self._wheel.pop(current, None)
+        if sockets:
+          due[current] = sockets
+        current += 1
+      if due:
+        try:
+          await self._check_heartbeats(due)
+        except Exception as e:
+          print(f"Error checking heartbeats: {e}")
+
+  # --- Presence / typing ---
+
+  def set_presence(self, chat_id : int, user_id : int, status : str):
+    """Records a user's presence in a room; only state changes schedule a broadcast"""
+    if status not in PRESENCE_STATUSES:
+      return
+    room = self.presence.setdefault(chat_id, {})
+    if room.get(user_id) != status:
+      room[user_id] = status
+      self._dirty_rooms.add(chat_id)
+
+  def set_typing(self, chat_id : int, user_id : int, is_typing : bool = True):
+    """Refreshes a user's typing deadline. Repeated keystrokes only extend the deadline"""
+    room = self.typing.setdefault(chat_id, {})
+    if is_typing:
+      if user_id not in room:
+        self._dirty_rooms.add(chat_id)
+      room[user_id] = time.monotonic() + settings.TYPING_TIMEOUT
+    elif room.pop(user_id, None) is not None:
+      self._dirty_rooms.add(chat_id)
+    if not room:
+      self.typing.pop(chat_id, None)
+
+  def _user_in_room(self, chat_id : int, user_id : int) -> bool:
+    room = self.active_connections.get(chat_id, ())
+    return any(ws in room for ws in self.user_connections.get(user_id, ()))
+
+  def _clear_user_state(self, chat_id : int, user_id : int):
+    room = self.presence.get(chat_id)
+    if room and room.pop(user_id, None) is not None:
+      self._dirty_rooms.add(chat_id)
+      if not room:
+        del self.presence[chat_id]
+    self.set_typing(chat_id, user_id, False)
+
+  def _expire_typing(self, now : float):
+    for chat_id in list(self.typing):
+      room = self.typing[chat_id]
+      expired = [user_id for user_id, deadline in room.items() if deadline <= now]
+      for user_id in expired:
+        del room[user_id]
+      if expired:
+        self._dirty_rooms.add(chat_id)
+      if not room:
+        del self.typing[chat_id]
+
+  def presence_snapshot(self, chat_id : int) -> dict:
+    room = self.presence.get(chat_id, {})
+    return {
+      "type": "presence",
+      "chat_id": chat_id,
+      "online": sorted(u for u, s in room.items() if s == "online"),
+      "away": sorted(u for u, s in room.items() if s == "away"),
+      "typing": sorted(self.typing.get(chat_id, {})),
+    }
+
+  async def flush_presence(self):
+    """Sends at most one batched presence frame per dirty room"""
+    self._expire_typing(time.monotonic())
+    dirty, self._dirty_rooms = self._dirty_rooms, set()
+    for chat_id in dirty:
+      if chat_id in self.active_connections:
+        await self.broadcast(self.presence_snapshot(chat_id), chat_id)
+
+  def _ensure_flusher(self):
+    if self._flusher is None or self._flusher.done():
+      self._flusher = asyncio.create_task(self._flush_loop())
+    if self._heartbeat is None or self._heartbeat.done():
+      self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+  async def _flush_loop(self):
+    while True:
+      await asyncio.sleep(settings.PRESENCE_FLUSH_INTERVAL)
+      try:
+        await self.flush_presence()
+      except Exception as e:
+        print(f"Error flushing presence: {e}")
+
 
 manager = WebSocketManager()
-    
\ No newline at end of file
+
@@ -0,0 +1,66 @@
+from fastapi import WebSocket
+import json
+import zlib
+
+from app.config import settings
+
+try:
+  import msgpack
+except ImportError:  # Binary protocol is simply not offered without msgpack
+  msgpack = None
+
+
+MSGPACK_SUBPROTOCOL = "chat.msgpack.v1"
+
+# First byte of every binary frame
+FRAME_RAW = 0x00
+FRAME_DEFLATE = 0x01
+
+
+def negotiate(websocket : WebSocket) -> str | None:
+  """Picks the compact subprotocol when the client offers it; None keeps plain JSON"""
+  if msgpack is not None and MSGPACK_SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+    return MSGPACK_SUBPROTOCOL
+  return None
+
+
+def encode_json(payload : dict) -> str:
+  return json.dumps(payload)
+
+def encode_binary(payload : dict) -> bytes:
+  """MessagePack body behind a one-byte header; large bodies are deflated"""
+  body = msgpack.packb(payload, use_bin_type=True)
+  if len(body) >= settings.WS_COMPRESS_THRESHOLD:
+    return bytes([FRAME_DEFLATE]) + zlib.compress(body, settings.WS_COMPRESS_LEVEL)
+  return bytes([FRAME_RAW]) + body
+
+class FrameTooLarge(ValueError):
+  """An inbound frame inflates past WS_MAX_INBOUND_FRAME_BYTES"""
+
+
+def decode_binary(data : bytes) -> dict | None:
+  if not data:
+    return None
+  limit = settings.WS_MAX_INBOUND_FRAME_BYTES
+  if data[0] == FRAME_DEFLATE:
+    # Bounded inflate: a tiny client frame must not expand into gigabytes
+    inflater = zlib.decompressobj()
+    body = inflater.decompress(data[1:], limit)
+    if inflater.unconsumed_tail or not inflater.eof:
+      raise FrameTooLarge(f"Deflated frame exceeds {limit} bytes")
+  else:
+    body = data[1:]
+  if len(body) > limit:
+    raise FrameTooLarge(f"Frame exceeds {limit} bytes")
+  return msgpack.unpackb(body, raw=False)
+
+
+def split_sender(payload : dict) -> tuple[dict, dict | None]:
+  """Replaces an embedded message sender with its id, returning (compact payload, sender)"""
+  message = payload.get("message")
+  if not isinstance(message, dict) or not isinstance(message.get("sender"), dict):
+    return payload, None
+  sender = message["sender"]
+  compact_message = {key: value for key, value in message.items() if key != "sender"}
+  compact_message["sender_id"] = sender["id"]
+  return {**payload, "message": compact_message}, sender
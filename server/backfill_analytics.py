@@ -0,0 +1,20 @@
+import argparse
+from datetime import date, timedelta
+from app.analytics import backfill_rollups
+
+
+def main():
+    """Rebuilds analytics rollups for past days from the message table."""
+    parser = argparse.ArgumentParser(description="Backfill message/moderation analytics rollups.")
+    parser.add_argument("--days", type=int, default=30, help="Number of closed days to rebuild, ending yesterday")
+    parser.add_argument("--start", type=date.fromisoformat, help="First day to rebuild (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, help="Last day to rebuild (defaults to yesterday)")
+    args = parser.parse_args()
+
+    end = args.end or date.today() - timedelta(days=1)
+    start = args.start or end - timedelta(days=args.days - 1)
+    print(f"Backfilling rollups from {start.isoformat()} to {end.isoformat()}...")
+    backfill_rollups(start, end)
+
+if __name__ == "__main__":
+    main()
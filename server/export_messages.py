@@ -0,0 +1,27 @@
+import argparse
+import sys
+from app.export import export_stream, iter_message_rows
+
+
+def main():
+    """Streams a chat's or user's message history to a file or stdout."""
+    parser = argparse.ArgumentParser(description="Export chat history as NDJSON or CSV.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--chat", type=int, help="ID of the chat to export")
+    target.add_argument("--user", type=int, help="ID of the user whose messages to export")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--gzip", action="store_true", help="Compress the output with gzip")
+    parser.add_argument("--output", help="Output file (defaults to stdout)")
+    args = parser.parse_args()
+
+    rows = iter_message_rows(chat_id=args.chat, sender_id=args.user)
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in export_stream(rows, args.format, args.gzip):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import argparse
+import json
+import time
+from app.bulk_import import import_users, read_rows
+
+
+def main():
+    """Bulk-creates users from a CSV or JSONL file and writes a per-row error report."""
+    parser = argparse.ArgumentParser(description="Bulk import users from CSV (name,email,password) or JSONL.")
+    parser.add_argument("file", help="Path to the CSV or JSONL file")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="Input format (defaults to the file extension)")
+    parser.add_argument("--batch-size", type=int, help="Rows per INSERT batch")
+    parser.add_argument("--workers", type=int, help="Hashing processes (defaults to all cores)")
+    parser.add_argument("--report", help="Write skipped/failed rows to this JSONL file")
+    args = parser.parse_args()
+
+    fmt = args.format or ("csv" if args.file.endswith(".csv") else "jsonl")
+    started = time.perf_counter()
+    with open(args.file, encoding="utf-8", newline="") as f:
+        summary = import_users(read_rows(f, fmt), batch_size=args.batch_size, workers=args.workers)
+    elapsed = time.perf_counter() - started
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            for entry in summary["errors"]:
+                f.write(json.dumps(entry) + "\n")
+
+    print("--- Bulk Import Finished ---")
+    print(f"Created: {summary['created']}")
+    print(f"Skipped: {summary['skipped']}")
+    print(f"Failed:  {summary['failed']}")
+    print(f"Elapsed: {elapsed:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import argparse
+from sqlmodel import Session
+from app import sharding
+from app.databases import engine
+
+
+def main():
+    """Creates message tables on the configured shards and moves chats between databases."""
+    parser = argparse.ArgumentParser(description="Manage message shards (SHARD_DATABASE_URLS).")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init", help="Create the message table on every shard and bound every database's id range")
+    rebalance = commands.add_parser("rebalance", help="Move chats whose messages are not on their placement shard")
+    rebalance.add_argument("--limit", type=int, default=None, help="Move at most this many chats")
+    rebalance.add_argument("--dry-run", action="store_true", help="Only list the chats that would move")
+    rebalance.add_argument("--chunk-size", type=int, default=1000, help="Messages copied/deleted per transaction")
+    move = commands.add_parser("move", help="Move one chat's messages to a shard")
+    move.add_argument("chat_id", type=int)
+    move.add_argument("--to", type=int, default=None, help="Target shard index; omit for the global database")
+    move.add_argument("--chunk-size", type=int, default=1000, help="Messages copied/deleted per transaction")
+    args = parser.parse_args()
+
+    if args.command == "init":
+        sharding.reserve_global_ids()
+        print("Global message ids capped below the first shard range")
+        for shard in range(len(sharding.shard_engines)):
+            sharding.create_shard_schema(shard)
+            print(f"Shard {shard} ready")
+        return
+
+    if args.command == "move":
+        moved = sharding.move_chat(args.chat_id, args.to, args.chunk_size)
+        print(f"Moved {moved} messages of chat {args.chat_id}")
+        return
+
+    with Session(engine) as db:
+        plan = list(sharding.misplaced_chats(db))[:args.limit]
+    for chat_id, shard, wanted in plan:
+        if args.dry_run:
+            print(f"Chat {chat_id}: {shard} -> {wanted}")
+            continue
+        moved = sharding.move_chat(chat_id, wanted, args.chunk_size)
+        print(f"Chat {chat_id}: moved {moved} messages {shard} -> {wanted}")
+    print(f"{len(plan)} chats {'to move' if args.dry_run else 'moved'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+from app.moderation import STAGES, Moderator
+from app.config import settings
+from app.schemas import ViolationStatus
+
+
+def load_corpus(path):
+    """Reads JSONL records of the form {"content": ..., "label": "approved" | "rejected" | ...}."""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def run_benchmark(records, moderator, passes=1, track_memory=False):
+    """Replays the corpus through the moderator and returns throughput, latency and accuracy figures."""
+    latencies = []
+    stage_latencies = {stage: [] for stage in STAGES}
+    counts = {"tp": 0, "fp": 0, "fn": 0, "tn": 0}
+    rejected = ViolationStatus.REJECTED.value
+
+    if track_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(passes):
+        for record in records:
+            timings = {}
+            t0 = time.perf_counter()
+            decision = moderator.moderate(record["content"], timings)
+            latencies.append(time.perf_counter() - t0)
+            for stage, seconds in timings.items():
+                stage_latencies[stage].append(seconds)
+
+            expected = record.get("label") == rejected
+            predicted = decision == rejected
+            counts[("t" if expected == predicted else "f") + ("p" if predicted else "n")] += 1
+    elapsed = time.perf_counter() - started
+    peak_memory = None
+    if track_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    total = len(latencies)
+    precision = counts["tp"] / (counts["tp"] + counts["fp"]) if counts["tp"] + counts["fp"] else 0.0
+    recall = counts["tp"] / (counts["tp"] + counts["fn"]) if counts["tp"] + counts["fn"] else 0.0
+    return {
+        "messages": total,
+        "elapsed_seconds": elapsed,
+        "messages_per_second": total / elapsed if elapsed else 0.0,
+        "latency_us": {
+            "p50": percentile(latencies, 50) * 1e6,
+            "p95": percentile(latencies, 95) * 1e6,
+            "p99": percentile(latencies, 99) * 1e6,
+            "mean": statistics.fmean(latencies) * 1e6 if latencies else 0.0,
+        },
+        "stage_latency_us": {
+            stage: {
+                "calls": len(values),
+                "p50": percentile(values, 50) * 1e6,
+                "p95": percentile(values, 95) * 1e6,
+            }
+            for stage, values in stage_latencies.items()
+        },
+        "peak_memory_bytes": peak_memory,
+        "confusion": counts,
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+    }
+
+def main():
+    """Benchmarks the moderation pipeline against a labelled corpus."""
+    parser = argparse.ArgumentParser(description="Replay a labelled corpus through moderation and report throughput/accuracy.")
+    parser.add_argument("corpus", help="JSONL file with 'content' and 'label' fields")
+    parser.add_argument("--blocklist", default=settings.MODERATION_BLOCKLIST_PATH, help="Blocklist file (defaults to MODERATION_BLOCKLIST_PATH)")
+    parser.add_argument("--cache-size", type=int, default=settings.MODERATION_CACHE_SIZE, help="Decision cache size (0 disables the cache)")
+    parser.add_argument("--passes", type=int, default=1, help="Replay the corpus this many times (later passes exercise the cache)")
+    parser.add_argument("--memory", action="store_true", help="Track peak memory with tracemalloc (slows the run)")
+    parser.add_argument("--json", action="store_true", help="Print the raw result as JSON")
+    args = parser.parse_args()
+
+    records = load_corpus(args.corpus)
+    moderator = Moderator(args.blocklist, cache_size=args.cache_size)
+    result = run_benchmark(records, moderator, passes=args.passes, track_memory=args.memory)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print("--- Moderation Benchmark ---")
+    print(f"Messages:   {result['messages']} in {result['elapsed_seconds']:.3f}s ({result['messages_per_second']:.0f} msg/s)")
+    latency = result["latency_us"]
+    print(f"Latency:    p50 {latency['p50']:.1f}us  p95 {latency['p95']:.1f}us  p99 {latency['p99']:.1f}us")
+    for stage, stats in result["stage_latency_us"].items():
+        print(f"  {stage:<10} calls {stats['calls']:>8}  p50 {stats['p50']:.1f}us  p95 {stats['p95']:.1f}us")
+    if result["peak_memory_bytes"] is not None:
+        print(f"Peak memory: {result['peak_memory_bytes'] / 1024:.1f} KiB")
+    print(f"Precision:  {result['precision']:.3f}  Recall: {result['recall']:.3f}  F1: {result['f1']:.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import os
+import sys
+import pytest
+
+# Settings are read at import time; tests only use throwaway SQLite databases
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_addoption(parser):
+  parser.addoption("--run-benchmarks", action="store_true", default=False, help="Run wall-clock benchmark tests")
+
+def pytest_configure(config):
+  config.addinivalue_line("markers", "benchmark: asserts wall-clock numbers; skipped unless --run-benchmarks")
+
+def pytest_collection_modifyitems(config, items):
+  if config.getoption("--run-benchmarks"):
+    return
+  skip = pytest.mark.skip(reason="wall-clock benchmark, pass --run-benchmarks")
+  for item in items:
+    if "benchmark" in item.keywords:
+      item.add_marker(skip)
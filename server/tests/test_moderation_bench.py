@@ -0,0 +1,56 @@
+import pytest
+
+from app.moderation import STAGES, Moderator
+from app.schemas import ViolationStatus
+from moderation_bench import run_benchmark
+
+
+REJECTED = ViolationStatus.REJECTED.value
+PENDING = ViolationStatus.PENDING_REVIEW.value
+
+# Small fixed corpus covering the evasions normalize() folds
+CORPUS = [
+  {"content": "hello there, how are you?", "label": PENDING},
+  {"content": "see you at the meeting tomorrow", "label": PENDING},
+  {"content": "you are a total scumbag", "label": REJECTED},
+  {"content": "SCUMBAG!!!", "label": REJECTED},
+  {"content": "sc\u200bumb4g", "label": REJECTED},
+  {"content": "ScUmBaG", "label": REJECTED},
+  {"content": "go jump off a bridge", "label": REJECTED},
+  {"content": "the bridge is closed today", "label": PENDING},
+] * 25
+
+
+@pytest.fixture
+def moderator(tmp_path):
+  blocklist = tmp_path / "blocklist.txt"
+  blocklist.write_text("# test terms\nscumbag\njump off a bridge\n", encoding="utf-8")
+  return Moderator(str(blocklist), cache_size=100)
+
+
+def test_benchmark_accuracy(moderator):
+  result = run_benchmark(CORPUS, moderator)
+
+  assert result["messages"] == len(CORPUS)
+  assert result["precision"] == 1.0
+  assert result["recall"] == 1.0
+  assert set(result["stage_latency_us"]) == set(STAGES)
+
+
+def test_benchmark_cache_serves_repeat_passes(moderator):
+  result = run_benchmark(CORPUS, moderator, passes=2)
+
+  # Only non-blocklisted messages reach the model stage, and only the first time each distinct text is seen
+  distinct_clean = len({record["content"] for record in CORPUS if record["label"] != REJECTED})
+  assert result["stage_latency_us"]["model"]["calls"] == distinct_clean
+  assert result["messages"] == 2 * len(CORPUS)
+
+
+@pytest.mark.benchmark
+def test_benchmark_throughput_floor(moderator):
+  result = run_benchmark(CORPUS, moderator, passes=4, track_memory=True)
+
+  # Deliberately loose: catches order-of-magnitude regressions on a quiet machine
+  assert result["messages_per_second"] > 1000
+  assert result["latency_us"]["p99"] < 10000
+  assert result["peak_memory_bytes"] is not None
@@ -0,0 +1,105 @@
+import pytest
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app import sharding
+from app.config import settings
+from app.model import Chat, Message, User
+
+
+SPAN = 1000
+
+
+@pytest.fixture
+def databases(tmp_path, monkeypatch):
+  """A global SQLite database and two SQLite shards, as in local development"""
+  global_engine = create_engine(f"sqlite:///{tmp_path / 'global.db'}")
+  shards = [create_engine(f"sqlite:///{tmp_path / f'shard{k}.db'}") for k in range(2)]
+  monkeypatch.setattr(settings, "SHARD_ID_SPAN", SPAN)
+  monkeypatch.setattr(sharding, "engine", global_engine)
+  monkeypatch.setattr(sharding, "shard_engines", shards)
+
+  SQLModel.metadata.create_all(global_engine)
+  for shard in range(len(shards)):
+    sharding.create_shard_schema(shard)
+  with Session(global_engine) as db:
+    db.add(User(id=1, name="sender", email="sender@example.com", password="x"))
+    for chat_id, shard in ((1, 1), (2, 0), (3, 1)):
+      db.add(Chat(id=chat_id, shard=shard))
+    db.commit()
+  return global_engine, shards
+
+
+def write(chat_id, count=3):
+  with Session(sharding.engine) as db:
+    shard = db.exec(select(Chat.shard).where(Chat.id == chat_id)).first()
+  with Session(sharding.engine_for(shard)) as session:
+    messages = [Message(content=f"message {n}", chat_id=chat_id, sender_id=1) for n in range(count)]
+    session.add_all(messages)
+    session.commit()
+    return [message.id for message in messages]
+
+
+def all_ids(global_engine, shards):
+  ids = []
+  for database in [global_engine, *shards]:
+    with Session(database) as session:
+      ids.extend(session.exec(select(Message.id)).all())
+  return ids
+
+
+def test_ids_stay_unique_when_chats_move(databases):
+  global_engine, shards = databases
+  moved = write(1)
+  assert all(2 * SPAN <= message_id < 3 * SPAN for message_id in moved)
+
+  assert sharding.move_chat(1, None) == len(moved)
+  assert sharding.move_chat(1, 0) == len(moved)
+
+  # Rows moved in keep their ids without shifting where each database allocates next
+  on_shard0 = write(2)
+  on_shard1 = write(3)
+  assert all(SPAN <= message_id < 2 * SPAN for message_id in on_shard0)
+  assert all(2 * SPAN <= message_id < 3 * SPAN for message_id in on_shard1)
+
+  ids = all_ids(global_engine, shards)
+  assert len(ids) == len(set(ids)) == 3 * len(moved)
+
+
+def test_global_database_allocates_below_the_shard_ranges(databases):
+  global_engine, shards = databases
+  sharding.move_chat(1, None)
+  write(1)  # chat 1 now lives in the global database, next to rows copied from shard 1
+  sharding.move_chat(3, None)
+  fresh = write(3)
+
+  assert all(1 <= message_id < SPAN for message_id in fresh)
+  ids = all_ids(global_engine, shards)
+  assert len(ids) == len(set(ids))
+
+
+def test_move_picks_up_writes_made_during_the_copy(databases, monkeypatch):
+  global_engine, shards = databases
+  edited, deleted, kept = write(1)
+  copy = sharding._copy_messages
+
+  def copy_then_write(source, target, chat_id, after_id, chunk_size):
+    result = copy(source, target, chat_id, after_id, chunk_size)
+    if after_id == 0:
+      # A writer edits and deletes copied rows while the first pass runs
+      with Session(shards[1]) as session:
+        session.get(Message, edited).content = "edited"
+        session.delete(session.get(Message, deleted))
+        session.commit()
+      with Session(global_engine) as db:
+        sharding.bump_chat_version(db, chat_id)
+        db.commit()
+    return result
+
+  monkeypatch.setattr(sharding, "_copy_messages", copy_then_write)
+  sharding.move_chat(1, 0)
+
+  with Session(shards[0]) as session:
+    rows = {message.id: message.content for message in session.exec(select(Message).where(Message.chat_id == 1))}
+  assert rows == {edited: "edited", kept: "message 2"}
+  with Session(shards[1]) as session:
+    assert session.exec(select(Message).where(Message.chat_id == 1)).all() == []